@@ -4,7 +4,7 @@ import re
 import streamlit as st
 
 from kg_summarizer.ai import general_summarize_abstracts
-from kg_summarizer.trapi import GraphContainer, query_knowledge_graph
+from kg_summarizer.trapi import GraphContainer, query_knowledge_graph, query_knowledge_graphs
 from kg_summarizer.queries import CREATIVE_QUERY_GRAPH_LIST, LOOKUP_QUERY_GRAPH_LIST
 
 
@@ -13,8 +13,14 @@ def graph_str_to_json(gs):
     gs = p.sub('\"', gs)
     return json.loads(gs)
 
-def submit_query(query_graph, target):
-    rjson = query_knowledge_graph(query_graph, target=target)
+def submit_query(query_graph, targets):
+    if not targets:
+        raise Exception('Select at least one query target')
+    elif len(targets) == 1:
+        rjson = query_knowledge_graph(query_graph, target=targets[0])
+    else:
+        # Query all targets concurrently and merge their results
+        rjson = query_knowledge_graphs(query_graph, targets=targets)
     n_results = len(rjson['message']['results'])
     st.write(f"Returned {n_results} results")
 
@@ -22,7 +28,7 @@ def submit_query(query_graph, target):
         raise Exception('Query failed to return results')    
     
     st.session_state['query_graph'] = query_graph
-    st.session_state['target'] = target
+    st.session_state['target'] = targets
     st.session_state['rjson'] = rjson
     st.session_state['n_results'] = n_results
 
@@ -32,7 +38,11 @@ def cached_query(query_graph, target):
 
 @st.cache_data(show_spinner="Fetching publications...")
 def setup_container(query_graph, rjson, result_idx):
-    return GraphContainer(query_graph, rjson, verbose=False, result_idx=result_idx)
+    g = GraphContainer(rjson, verbose=False, result_idx=result_idx)
+    # Every edge and support graph gets rendered, so fetch all their abstracts in one batch.
+    # Node publications are never shown, they stay lazy
+    g.prefetch(nodes=[])
+    return g
 
 def display_edge(edge, summarization_type, sentence):
     if summarization_type == 'None':
@@ -49,7 +59,7 @@ def display_edge(edge, summarization_type, sentence):
         pass
     
 with st.sidebar:
-    target = st.selectbox('Query Target', ('aragorn', 'robokop', 'strider'))
+    targets = st.multiselect('Query Targets', ('aragorn', 'robokop', 'strider'), default=['aragorn'])
     query_type = st.selectbox('Query Type', ('lookup', 'creative'))
 
     if query_type == 'lookup':
@@ -61,7 +71,7 @@ with st.sidebar:
     query_graph = graph_list[query_idx]
     st.write('Query Graph')
     st.json(query_graph)
-    st.button('Submit Query', on_click=submit_query, args=(query_graph, target, ))
+    st.button('Submit Query', on_click=submit_query, args=(query_graph, targets, ))
 
 if 'rjson' in st.session_state:
     with st.form('results'):
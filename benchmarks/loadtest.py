@@ -0,0 +1,275 @@
+"""
+Load test of kg_summarizer.server.app: runs the app under uvicorn (one worker) against the
+stub upstreams of benchmarks/stubs.py and drives /summarize/abstract or /summarize/edges with
+a closed loop of concurrent clients, for every scenario and concurrency level.
+
+    python -m benchmarks.loadtest --endpoint abstract --concurrency 1,8,32,64 --duration 20
+    python -m benchmarks.loadtest --endpoint edges --scenario baseline,openai_429 \\
+        --upstream openai:latency=1,distribution=lognormal
+
+Scenarios set the latency distribution and fault rates (429, 503, hanging requests) of the
+upstreams on top of the baseline latencies, --upstream adjusts them further. Reports
+throughput, latency percentiles, status codes and error rates, and appends them to
+benchmarks/loadtest_results.jsonl.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import socket
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+import aiohttp
+import requests
+
+from benchmarks.run import configure, git_commit
+from benchmarks.stubs import StubServer, UpstreamBehavior, parse_behavior
+from benchmarks.synthetic import make_trapi_response
+
+RESULTS_FILE = Path(__file__).parent / 'loadtest_results.jsonl'
+
+BASELINE = dict(
+    ara=dict(latency=0.5),
+    node_normalizer=dict(latency=0.05),
+    eutils=dict(latency=0.3),
+    openai=dict(latency=1.0, distribution='lognormal'),
+)
+SCENARIOS = dict(
+    baseline={},
+    slow_openai=dict(openai=dict(latency=5.0, distribution='lognormal', jitter=0.8)),
+    openai_429=dict(openai=dict(throttle_rate=0.2)),
+    openai_5xx=dict(openai=dict(error_rate=0.1)),
+    openai_timeouts=dict(openai=dict(timeout_rate=0.05)),
+    slow_eutils=dict(eutils=dict(latency=3.0, distribution='exponential')),
+    eutils_5xx=dict(eutils=dict(error_rate=0.3)),
+    eutils_429=dict(eutils=dict(throttle_rate=0.3)),
+)
+
+
+def scenario_behaviors(scenario, upstream_specs=()):
+    behaviors = {}
+    for upstream, fields in BASELINE.items():
+        behaviors[upstream] = UpstreamBehavior(**{**fields, **SCENARIOS[scenario].get(upstream, {})})
+    for spec in upstream_specs:
+        parse_behavior(spec, behaviors)
+    return behaviors
+
+def serve_app(port, urls, cache_dir, overrides):
+    import kg_summarizer.config as CFG
+
+    # Config first, the server modules read it at import time
+    configure(urls, cache_dir, overrides.pop('PUBMED_REQUESTS_PER_SECOND'))
+    for name, value in overrides.items():
+        setattr(CFG, name, value)
+
+    import uvicorn
+    from kg_summarizer.server import app
+    uvicorn.run(app, host='127.0.0.1', port=port, log_level='warning')
+
+
+class AppServer:
+    """
+    kg_summarizer.server.app under uvicorn in a child process, pointed at the stubs.
+    """
+
+    def __init__(self, urls, overrides):
+        self.urls = urls
+        self.overrides = overrides
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.process = None
+
+    def __enter__(self):
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(
+            target=serve_app, args=(self.port, self.urls, self.cache_dir.name, dict(self.overrides)), daemon=True
+        )
+        self.process.start()
+
+        deadline = time.time() + 120
+        while True:
+            try:
+                requests.get(f'{self.base_url}/openapi.json', timeout=10)
+                return self
+            except requests.exceptions.ConnectionError:
+                if (time.time() > deadline) or not self.process.is_alive():
+                    raise RuntimeError('kg_summarizer server did not start')
+                time.sleep(0.2)
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
+        self.cache_dir.cleanup()
+
+
+@dataclass
+class Sample:
+    seconds: float
+    status: str # HTTP status code, 'client_timeout' or 'client_error'
+    n_items: int = 0 # edges endpoint: streamed edge summaries
+    n_item_errors: int = 0 # edges endpoint: edge summaries with an error
+
+
+def make_payload_factory(endpoint, args):
+    llm = dict(gpt_model=args.model, use_cache=args.cache)
+    if endpoint == 'abstract':
+        words = ' '.join(f'word{i % 500}' for i in range(args.abstract_words))
+
+        def make_payload(request_idx):
+            # Unique text per request so the completion cache can't serve it
+            return json.dumps(dict(abstract=f'Abstract {request_idx}: {words}', parameters=dict(llm=llm)))
+        return '/summarize/abstract', make_payload
+
+    def make_payload(request_idx):
+        # Same graph, mostly new PMIDs per request so eutils and the summary stores see misses
+        response = make_trapi_response(
+            creative=args.creative, n_results=args.results, n_nodes=args.results, n_edges=args.results,
+            n_pmids=args.pmids, pmid_pool=10_000_000, seed=request_idx,
+        )
+        return json.dumps(dict(response=response, parameters=dict(llm=llm)))
+    return '/summarize/edges', make_payload
+
+async def drive(base_url, endpoint, make_payload, concurrency, duration, timeout):
+    """
+    Closed loop: `concurrency` clients send requests back to back for `duration` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    samples = []
+    deadline = loop.time() + duration
+
+    async def client(session, client_idx):
+        request_idx = client_idx
+        while loop.time() < deadline:
+            data = make_payload(request_idx)
+            request_idx += concurrency
+
+            start_time = loop.time()
+            sample = Sample(0.0, 'client_error')
+            try:
+                async with session.post(
+                    f'{base_url}{endpoint}', data=data, headers={'Content-Type': 'application/json'}
+                ) as response:
+                    sample.status = str(response.status)
+                    if endpoint == '/summarize/edges' and response.status == 200:
+                        async for line in response.content:
+                            if line.strip():
+                                sample.n_items += 1
+                                sample.n_item_errors += 'error' in json.loads(line)
+                    else:
+                        await response.read()
+            except asyncio.TimeoutError:
+                sample.status = 'client_timeout'
+            except aiohttp.ClientError:
+                sample.status = 'client_error'
+            sample.seconds = loop.time() - start_time
+            samples.append(sample)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start_time = loop.time()
+        await asyncio.gather(*[client(session, client_idx) for client_idx in range(concurrency)])
+        wall_seconds = loop.time() - start_time
+
+    return samples, wall_seconds
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+def summarize_samples(samples, wall_seconds):
+    latencies = sorted(sample.seconds for sample in samples)
+    statuses = Counter(sample.status for sample in samples)
+    n_items = sum(sample.n_items for sample in samples)
+    return dict(
+        requests=len(samples),
+        throughput_rps=round(len(samples) / wall_seconds, 3),
+        latency_seconds={
+            f'p{q}': round(percentile(latencies, q), 4) if latencies else None for q in (50, 90, 99)
+        } | dict(max=round(latencies[-1], 4) if latencies else None),
+        statuses=dict(statuses),
+        error_rate=round(1 - statuses.get('200', 0) / len(samples), 4) if samples else None,
+        item_error_rate=round(sum(s.n_item_errors for s in samples) / n_items, 4) if n_items else None,
+    )
+
+def print_summary(scenario, concurrency, summary, upstream_stats):
+    latency = summary['latency_seconds']
+    item_errors = '' if summary['item_error_rate'] is None else f" item_err={summary['item_error_rate']:.2%}"
+    print(
+        f"{scenario:<16} c={concurrency:<4} n={summary['requests']:<6} {summary['throughput_rps']:>8.2f} req/s"
+        f"  p50={latency['p50']}s p90={latency['p90']}s p99={latency['p99']}s max={latency['max']}s"
+        f"  err={summary['error_rate']:.2%}{item_errors}  {summary['statuses']}"
+    )
+    faults = ', '.join(
+        f"{upstream}={stats['calls']} ({stats['throttle']}x429 {stats['error']}x503 {stats['timeout']} hung)"
+        for upstream, stats in upstream_stats.items() if stats['calls']
+    )
+    print(f"{'':<16} upstream calls: {faults}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint', choices=('abstract', 'edges'), default='abstract')
+    parser.add_argument('--scenario', default='baseline', help=f"comma separated, 'all' or any of {list(SCENARIOS)}")
+    parser.add_argument('--upstream', action='append', default=[], help="e.g. 'openai:latency=2,throttle_rate=0.1'")
+    parser.add_argument('--concurrency', default='1,8,32', help='comma separated concurrent clients')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per concurrency level')
+    parser.add_argument('--timeout', type=float, default=300, help='client side request timeout')
+    parser.add_argument('--openai-timeout', type=float, default=30, help='OPENAI_REQUEST_TIMEOUT of the server')
+    parser.add_argument('--requests-per-second', type=float, default=10, help='eutils rate limit of the server')
+    parser.add_argument('--model', default='gpt-3.5-turbo')
+    parser.add_argument('--cache', action='store_true', help='let the server use the completion cache')
+    parser.add_argument('--abstract-words', type=int, default=250)
+    parser.add_argument('--results', type=int, default=5, help='edges endpoint: TRAPI results of the payload')
+    parser.add_argument('--pmids', type=int, default=5, help='edges endpoint: publications per node/edge')
+    parser.add_argument('--creative', action='store_true', help='edges endpoint: creative payload')
+    parser.add_argument('--output', type=Path, default=RESULTS_FILE)
+    args = parser.parse_args(argv)
+
+    scenarios = list(SCENARIOS) if args.scenario == 'all' else args.scenario.split(',')
+    concurrency_levels = [int(c) for c in args.concurrency.split(',')]
+    endpoint, make_payload = make_payload_factory(args.endpoint, args)
+    overrides = dict(
+        OPENAI_REQUEST_TIMEOUT=args.openai_timeout,
+        PUBMED_REQUESTS_PER_SECOND=args.requests_per_second,
+    )
+
+    for scenario in scenarios:
+        behaviors = scenario_behaviors(scenario, args.upstream)
+        with StubServer(behaviors, dict(n_results=args.results, n_pmids=args.pmids)) as stubs, \
+                AppServer(stubs.urls, overrides) as app_server:
+            for concurrency in concurrency_levels:
+                stubs.reset()
+                samples, wall_seconds = asyncio.run(
+                    drive(app_server.base_url, endpoint, make_payload, concurrency, args.duration, args.timeout)
+                )
+                summary = summarize_samples(samples, wall_seconds)
+                upstream_stats = stubs.stats()
+                print_summary(scenario, concurrency, summary, upstream_stats)
+
+                record = dict(
+                    timestamp=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                    git_commit=git_commit(),
+                    endpoint=endpoint,
+                    scenario=scenario,
+                    concurrency=concurrency,
+                    duration=args.duration,
+                    upstreams=stubs.describe(),
+                    server=overrides,
+                    summary=summary,
+                    upstream_stats=upstream_stats,
+                )
+                args.output.parent.mkdir(parents=True, exist_ok=True)
+                with open(args.output, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(record) + '\n')
+
+
+if __name__ == '__main__':
+    main()
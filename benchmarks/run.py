@@ -0,0 +1,230 @@
+"""
+Offline benchmark of the query -> GraphContainer -> (summarization) pipeline against the
+local stub upstreams of benchmarks/stubs.py.
+
+    python -m benchmarks.run --scenario creative --results 200 --latency ara=1,eutils=0.2
+    python -m benchmarks.run --compare
+
+Every scenario runs `--repeat` times with cold caches (each followed by a warm run), then once
+more under tracemalloc for the peak memory. Results are appended to benchmarks/results.jsonl
+(one JSON object per scenario run) and --compare prints the change from the previous stored
+run of the same scenario and parameters.
+"""
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+import kg_summarizer.config as CFG
+
+from benchmarks.stubs import StubServer, parse_latencies
+
+RESULTS_FILE = Path(__file__).parent / 'results.jsonl'
+
+
+def configure(urls, cache_dir, requests_per_second):
+    """
+    Points kg_summarizer at the stubs and a scratch cache. Has to run before the other
+    kg_summarizer modules are imported since they read the config at import time.
+    """
+    for name, value in urls.items():
+        setattr(CFG, name, value)
+    CFG.CACHE_DIR = Path(cache_dir)
+    CFG.PUBMED_REQUESTS_PER_SECOND = requests_per_second
+    CFG.ENV.setdefault('OPENAI_ORGANIZATION_ID', 'benchmark')
+    CFG.ENV.setdefault('OPENAI_API_KEY', 'benchmark')
+
+def clear_caches():
+    from kg_summarizer import ai, trapi, utils
+
+    for cache in (utils.NODE_NORM_CACHE, utils.PUBMED_ABSTRACT_STORE, trapi.QUERY_CACHE,
+                  ai.COMPLETION_CACHE, ai.ABSTRACT_SUMMARY_STORE):
+        cache.clear()
+
+def run_pipeline(query_graph, target, summarize):
+    """
+    One pass of the pipeline, returns the wall time of each phase and the container profile.
+    """
+    from kg_summarizer.ai import ageneral_summarize_abstracts
+    from kg_summarizer.trapi import GraphContainer, query_knowledge_graph
+
+    phases = {}
+    start_time = perf_counter()
+    response = query_knowledge_graph(query_graph, target=target)
+    phases['query'] = perf_counter() - start_time
+
+    start_time = perf_counter()
+    g = GraphContainer(response, verbose=False)
+    g.prefetch()
+    phases['container'] = perf_counter() - start_time
+
+    if summarize:
+        async def summarize_edges():
+            jobs = [(edge, f"{edge['subject']} {edge['predicate']} {edge['object']}") for edge in g.edges]
+            for edge in g.edges:
+                for sentence, sg_edge_list in edge.get('support_graphs', {}).items():
+                    jobs.extend(
+                        (sg_edge, f"{sg_edge['subject']} {sg_edge['predicate']} {sg_edge['object']}")
+                        for sg_edge in sg_edge_list
+                    )
+            await asyncio.gather(*[
+                ageneral_summarize_abstracts(edge, statement) for edge, statement in jobs if edge['publications']
+            ])
+
+        start_time = perf_counter()
+        asyncio.run(summarize_edges())
+        phases['summarize'] = perf_counter() - start_time
+
+    phases['total'] = sum(phases.values())
+    return {phase: round(seconds, 4) for phase, seconds in phases.items()}, g.profile.as_dict()
+
+def run_scenario(stubs, scenario, args):
+    from benchmarks.synthetic import make_query_graph
+
+    query_graph = make_query_graph(creative=(scenario == 'creative'))
+    runs = []
+    for _ in range(args.repeat):
+        clear_caches()
+        for cache_state in ('cold', 'warm'):
+            stubs.reset()
+            phases, profile = run_pipeline(query_graph, args.target, args.summarize)
+            runs.append(dict(cache=cache_state, phases=phases, profile=profile, upstream=stubs.stats()))
+
+    # Separate run for memory, tracemalloc slows everything down
+    clear_caches()
+    tracemalloc.start()
+    run_pipeline(query_graph, args.target, args.summarize)
+    peak_memory_mb = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    return dict(runs=runs, peak_memory_mb=round(peak_memory_mb, 2))
+
+def summarize_runs(runs):
+    summary = {}
+    for cache_state in ('cold', 'warm'):
+        state_runs = [run for run in runs if run['cache'] == cache_state]
+        summary[cache_state] = dict(
+            wall_seconds={
+                phase: round(median(run['phases'][phase] for run in state_runs), 4)
+                for phase in state_runs[0]['phases']
+            },
+            upstream_calls={
+                upstream: stats['calls'] for upstream, stats in state_runs[0]['upstream'].items()
+            },
+        )
+    return summary
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=CFG.PROJ_DIR, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_results(results_file):
+    if not results_file.exists():
+        return []
+    with open(results_file, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def print_record(record, previous=None):
+    print(f"\n{record['scenario']} {json.dumps(record['params'])}")
+    print(f"peak memory: {record['peak_memory_mb']} MB")
+    for cache_state, state_summary in record['summary'].items():
+        print(f"  {cache_state}")
+        for phase, seconds in state_summary['wall_seconds'].items():
+            line = f"    {phase:<12} {seconds:>9.3f}s"
+            if previous is not None:
+                before = previous['summary'][cache_state]['wall_seconds'].get(phase)
+                if before:
+                    line += f"   (was {before:.3f}s, {100 * (seconds - before) / before:+.1f}%)"
+            print(line)
+        calls = ', '.join(f"{upstream}={n}" for upstream, n in state_summary['upstream_calls'].items())
+        print(f"    upstream calls: {calls}")
+
+def find_previous(results, record):
+    for previous in reversed(results):
+        if (previous['scenario'], previous['params']) == (record['scenario'], record['params']):
+            return previous
+    return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=('lookup', 'creative', 'all'), default='all')
+    parser.add_argument('--results', type=int, default=100, help='TRAPI results')
+    parser.add_argument('--nodes', type=int, default=500, help='knowledge graph nodes')
+    parser.add_argument('--edges', type=int, default=1000, help='knowledge graph edges (lookup)')
+    parser.add_argument('--attributes', type=int, default=5, help='filler attributes per node/edge')
+    parser.add_argument('--pmids', type=int, default=5, help='publications per node/edge')
+    parser.add_argument('--support-graphs', type=int, default=3, help='support graphs per inferred edge (creative)')
+    parser.add_argument('--abstract-words', type=int, default=200)
+    parser.add_argument('--latency', default='', help="seconds per upstream, e.g. 'ara=1,node_normalizer=0.05,eutils=0.2,openai=0.5'")
+    parser.add_argument('--requests-per-second', type=float, default=CFG.PUBMED_REQUESTS_PER_SECOND, help='eutils rate limit')
+    parser.add_argument('--target', default='aragorn')
+    parser.add_argument('--summarize', action='store_true', help='also summarize every edge (needs the tiktoken encodings cached)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', type=Path, default=RESULTS_FILE)
+    parser.add_argument('--compare', action='store_true', help='only compare the last stored runs of each scenario')
+    args = parser.parse_args(argv)
+
+    results = load_results(args.output)
+    if args.compare:
+        latest = {}
+        for idx, record in enumerate(results):
+            latest[(record['scenario'], json.dumps(record['params'], sort_keys=True))] = idx
+        for idx in sorted(latest.values()):
+            print_record(results[idx], find_previous(results[:idx], results[idx]))
+        return
+
+    scenarios = ('lookup', 'creative') if args.scenario == 'all' else (args.scenario,)
+    trapi_kwargs = dict(
+        n_results=args.results,
+        n_nodes=args.nodes,
+        n_edges=args.edges,
+        n_attributes=args.attributes,
+        n_pmids=args.pmids,
+        n_support_graphs=args.support_graphs,
+    )
+    behaviors = parse_latencies(args.latency)
+
+    with StubServer(behaviors, trapi_kwargs, abstract_words=args.abstract_words) as stubs, \
+            tempfile.TemporaryDirectory() as cache_dir:
+        configure(stubs.urls, cache_dir, args.requests_per_second)
+
+        for scenario in scenarios:
+            scenario_result = run_scenario(stubs, scenario, args)
+            record = dict(
+                timestamp=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                git_commit=git_commit(),
+                scenario=scenario,
+                params=dict(
+                    **trapi_kwargs,
+                    abstract_words=args.abstract_words,
+                    latency=stubs.describe(),
+                    requests_per_second=args.requests_per_second,
+                    summarize=args.summarize,
+                    target=args.target,
+                ),
+                summary=summarize_runs(scenario_result['runs']),
+                peak_memory_mb=scenario_result['peak_memory_mb'],
+                max_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+                runs=scenario_result['runs'],
+            )
+            print_record(record, find_previous(results, record))
+
+            args.output.parent.mkdir(parents=True, exist_ok=True)
+            with open(args.output, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(record) + '\n')
+            results.append(record)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Local stand-ins for the node normalizer, eutils efetch, the ARAs and the OpenAI chat API,
+served by one aiohttp app in a child process. Every upstream has an injectable latency
+distribution and fault rates (429, 5xx, hanging requests), and the stubs count the calls they
+receive (GET /_stats, POST /_reset).
+"""
+import asyncio
+import json
+import math
+import multiprocessing
+import random
+import socket
+import time
+from dataclasses import dataclass, asdict
+from xml.sax.saxutils import escape
+
+import requests
+from aiohttp import web
+
+from benchmarks.synthetic import make_trapi_response
+
+UPSTREAMS = ('ara', 'node_normalizer', 'eutils', 'openai')
+
+
+@dataclass
+class UpstreamBehavior:
+    latency: float = 0.0 # mean seconds per request
+    distribution: str = 'uniform' # uniform, exponential, lognormal or fixed
+    jitter: float = 0.5 # uniform: +/- fraction of the latency, lognormal: sigma
+    throttle_rate: float = 0.0 # fraction of requests answered with 429
+    error_rate: float = 0.0 # fraction of requests answered with 503
+    timeout_rate: float = 0.0 # fraction of requests that hang for hang_seconds (then 504)
+    hang_seconds: float = 600.0
+
+    def delay(self, rnd):
+        if self.latency <= 0 or self.distribution == 'fixed':
+            return max(0.0, self.latency)
+        if self.distribution == 'uniform':
+            return max(0.0, self.latency * (1 + rnd.uniform(-self.jitter, self.jitter)))
+        if self.distribution == 'exponential':
+            return rnd.expovariate(1 / self.latency)
+        if self.distribution == 'lognormal':
+            # mu chosen so the mean is `latency`
+            return rnd.lognormvariate(math.log(self.latency) - self.jitter ** 2 / 2, self.jitter)
+        raise ValueError(f"Unknown latency distribution '{self.distribution}'")
+
+    def fault(self, rnd):
+        """
+        None, 'timeout', 'throttle' or 'error' for the next request.
+        """
+        draw = rnd.random()
+        for fault, rate in (('timeout', self.timeout_rate), ('throttle', self.throttle_rate), ('error', self.error_rate)):
+            if draw < rate:
+                return fault
+            draw -= rate
+        return None
+
+
+def parse_latencies(spec):
+    """
+    'ara=1,eutils=0.2' -> {'ara': UpstreamBehavior(latency=1.0), ...}
+    """
+    behaviors = {upstream: UpstreamBehavior() for upstream in UPSTREAMS}
+    for item in filter(None, (spec or '').split(',')):
+        upstream, seconds = item.split('=')
+        if upstream not in behaviors:
+            raise ValueError(f"Unknown upstream '{upstream}', expected one of {UPSTREAMS}")
+        behaviors[upstream].latency = float(seconds)
+    return behaviors
+
+def parse_behavior(spec, behaviors):
+    """
+    Updates `behaviors` from 'openai:latency=2,distribution=lognormal,throttle_rate=0.1'.
+    """
+    upstream, _, fields = spec.partition(':')
+    if upstream not in behaviors:
+        raise ValueError(f"Unknown upstream '{upstream}', expected one of {UPSTREAMS}")
+    for item in filter(None, fields.split(',')):
+        name, value = item.split('=')
+        if name not in UpstreamBehavior.__dataclass_fields__:
+            raise ValueError(f"Unknown upstream behavior '{name}'")
+        setattr(behaviors[upstream], name, value if name == 'distribution' else float(value))
+    return behaviors
+
+def pubmed_xml(pmids, abstract_words):
+    articles = []
+    for pmid in pmids:
+        words = ' '.join(f'w{(int(pmid) * 7 + i) % 997}' for i in range(abstract_words))
+        articles.append(
+            f'<PubmedArticle><MedlineCitation><PMID>{escape(pmid)}</PMID><Article><Abstract>'
+            f'<AbstractText Label="RESULTS">Abstract of {escape(pmid)}: {words}</AbstractText>'
+            f'</Abstract></Article></MedlineCitation></PubmedArticle>'
+        )
+    return '<?xml version="1.0"?><PubmedArticleSet>' + ''.join(articles) + '</PubmedArticleSet>'
+
+def make_stub_app(behaviors, trapi_kwargs, abstract_words=200, seed=0):
+    rnd = random.Random(seed)
+    stats = {upstream: dict(calls=0, items=0, timeout=0, throttle=0, error=0) for upstream in UPSTREAMS}
+    trapi_bodies = {}
+
+    def trapi_body(creative):
+        # Lookup or creative answer depending on the query graph, generated on first use
+        if creative not in trapi_bodies:
+            trapi_bodies[creative] = json.dumps(make_trapi_response(creative=creative, **trapi_kwargs)).encode('utf-8')
+        return trapi_bodies[creative]
+
+    async def upstream_call(upstream, n_items=1):
+        """
+        Waits out the latency, returns an error response for injected faults (else None).
+        """
+        behavior = behaviors[upstream]
+        stats[upstream]['calls'] += 1
+        stats[upstream]['items'] += n_items
+
+        fault = behavior.fault(rnd)
+        if fault is not None:
+            stats[upstream][fault] += 1
+        if fault == 'timeout':
+            await asyncio.sleep(behavior.hang_seconds)
+            return fault_response(upstream, 504, 'Gateway timeout')
+        await asyncio.sleep(behavior.delay(rnd))
+        if fault == 'throttle':
+            return fault_response(upstream, 429, 'Rate limit reached', headers={'Retry-After': '1'})
+        if fault == 'error':
+            return fault_response(upstream, 503, 'Service unavailable')
+        return None
+
+    def fault_response(upstream, status, message, headers=None):
+        if upstream == 'openai':
+            # Error body the openai client understands
+            error = dict(message=message, type='server_error' if status >= 500 else 'requests', param=None, code=None)
+            return web.json_response(dict(error=error), status=status, headers=headers)
+        return web.Response(status=status, text=message, headers=headers)
+
+    async def node_normalizer(request):
+        curies = (await request.json())['curies']
+        fault = await upstream_call('node_normalizer', len(curies))
+        if fault is not None:
+            return fault
+        return web.json_response({
+            curie: dict(id=dict(identifier=curie, label=f'Label {curie}'), type=['biolink:NamedThing'])
+            for curie in curies
+        })
+
+    async def efetch(request):
+        pmids = (await request.post())['id'].split(',')
+        fault = await upstream_call('eutils', len(pmids))
+        if fault is not None:
+            return fault
+        return web.Response(text=pubmed_xml(pmids, abstract_words), content_type='text/xml')
+
+    async def ara(request):
+        query_graph = (await request.json())['message']['query_graph']
+        fault = await upstream_call('ara')
+        if fault is not None:
+            return fault
+        body = trapi_body('t_edge' in query_graph['edges'])
+        return web.Response(body=body, content_type='application/json')
+
+    async def chat_completions(request):
+        body = await request.json()
+        system_prompt, user_prompt = (m['content'] for m in body['messages'])
+        fault = await upstream_call('openai')
+        if fault is not None:
+            return fault
+
+        if 'JSON object' in system_prompt:
+            # Packed abstract summaries (ai.abstract_pack_prompt)
+            content = json.dumps({pmid: f'Summary of {pmid}.' for pmid in json.loads(user_prompt)})
+        else:
+            content = f'- Summary of {len(user_prompt)} characters of input.'
+        prompt_tokens = (len(system_prompt) + len(user_prompt)) // 4
+        return web.json_response(dict(
+            id='chatcmpl-stub', object='chat.completion', created=int(time.time()), model=body['model'],
+            choices=[dict(index=0, message=dict(role='assistant', content=content), finish_reason='stop')],
+            usage=dict(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=len(content) // 4,
+                total_tokens=prompt_tokens + len(content) // 4,
+            ),
+        ))
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    async def reset_stats(request):
+        for upstream_stats in stats.values():
+            upstream_stats.update(calls=0, items=0, timeout=0, throttle=0, error=0)
+        return web.json_response(stats)
+
+    app = web.Application(client_max_size=1 << 30)
+    app.router.add_post('/nodenorm/get_normalized_nodes', node_normalizer)
+    app.router.add_post('/eutils/efetch.fcgi', efetch)
+    app.router.add_post('/aragorn/query', ara)
+    app.router.add_post('/robokop/query', ara)
+    app.router.add_post('/strider/query/', ara)
+    app.router.add_post('/v1/chat/completions', chat_completions)
+    app.router.add_get('/_stats', get_stats)
+    app.router.add_post('/_reset', reset_stats)
+    return app
+
+def serve(port, behaviors, trapi_kwargs, abstract_words):
+    app = make_stub_app(behaviors, trapi_kwargs, abstract_words)
+    web.run_app(app, host='127.0.0.1', port=port, print=None, handle_signals=False)
+
+
+class StubServer:
+    """
+    Runs the stub upstreams in a child process (so their work doesn't show up in the
+    benchmarked process) for the duration of a with block.
+    """
+
+    def __init__(self, behaviors, trapi_kwargs, abstract_words=200):
+        self.behaviors = behaviors
+        self.trapi_kwargs = trapi_kwargs
+        self.abstract_words = abstract_words
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.process = None
+
+    @property
+    def urls(self):
+        """
+        Config overrides pointing kg_summarizer at the stubs.
+        """
+        return dict(
+            NODE_NORM_URL=f'{self.base_url}/nodenorm/get_normalized_nodes',
+            EFETCH_URL=f'{self.base_url}/eutils/efetch.fcgi',
+            ARAGORN_BASE_URL=self.base_url,
+            STRIDER_URL=f'{self.base_url}/strider/query/',
+            OPENAI_API_BASE=f'{self.base_url}/v1',
+        )
+
+    def __enter__(self):
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(
+            target=serve, args=(self.port, self.behaviors, self.trapi_kwargs, self.abstract_words), daemon=True
+        )
+        self.process.start()
+
+        deadline = time.time() + 120
+        while True:
+            try:
+                self.stats()
+                return self
+            except requests.exceptions.ConnectionError:
+                if (time.time() > deadline) or not self.process.is_alive():
+                    raise RuntimeError('Stub upstreams did not start')
+                time.sleep(0.1)
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
+
+    def stats(self):
+        return requests.get(f'{self.base_url}/_stats', timeout=10).json()
+
+    def reset(self):
+        requests.post(f'{self.base_url}/_reset', timeout=10)
+
+    def describe(self):
+        return {upstream: asdict(behavior) for upstream, behavior in self.behaviors.items()}
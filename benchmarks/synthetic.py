@@ -0,0 +1,134 @@
+"""
+Synthetic TRAPI responses with the shape of ARA answers, sized by the number of results,
+knowledge graph nodes/edges, attributes, PMIDs and support graphs.
+"""
+import random
+
+DISEASE = 'MONDO:0005148'
+PREFIXES = ('CHEBI', 'NCBIGene', 'MONDO', 'HP', 'UniProtKB')
+PREDICATES = (
+    'biolink:affects', 'biolink:interacts_with', 'biolink:gene_associated_with_condition',
+    'biolink:related_to', 'biolink:regulates',
+)
+SOURCES = [{'resource_id': 'infores:benchmark', 'resource_role': 'primary_knowledge_source'}]
+
+
+def make_query_graph(creative=False):
+    qedge_id = 't_edge' if creative else 'e0'
+    qedge = dict(subject='n0', object='n1', predicates=['biolink:treats'])
+    if creative:
+        qedge['knowledge_type'] = 'inferred'
+    return dict(
+        nodes=dict(
+            n0=dict(categories=['biolink:ChemicalEntity']),
+            n1=dict(ids=[DISEASE], categories=['biolink:Disease']),
+        ),
+        edges={qedge_id: qedge},
+    )
+
+def make_trapi_response(
+    creative=False,
+    n_results=100,
+    n_nodes=500,
+    n_edges=1000,
+    n_attributes=5,
+    n_pmids=5,
+    n_support_graphs=3,
+    support_graph_length=2,
+    pmid_pool=5000,
+    seed=0,
+):
+    """
+    Returns a {'message': ...} TRAPI response.
+
+    Results bind n0 to a node of an `n_nodes` pool and n1 to one disease. Lookup responses
+    spread `n_edges` knowledge graph edges over the results. Creative responses have one
+    inferred edge per result whose `n_support_graphs` support graphs are paths of
+    `support_graph_length` edges. Every node and edge carries `n_attributes` filler attributes
+    and `n_pmids` publications drawn from a pool of `pmid_pool` PMIDs (so PMIDs repeat across
+    edges like in real answers).
+    """
+    rnd = random.Random(seed)
+
+    def pmids():
+        return [f'PMID:{rnd.randint(1, pmid_pool)}' for _ in range(n_pmids)]
+
+    def filler_attributes():
+        return [
+            dict(attribute_type_id='biolink:has_attribute', original_attribute_name=f'attr_{i}', value=rnd.random())
+            for i in range(n_attributes)
+        ]
+
+    node_ids = [f'{PREFIXES[i % len(PREFIXES)]}:{100000 + i}' for i in range(n_nodes)]
+    nodes = {}
+    for curie in node_ids + [DISEASE]:
+        nodes[curie] = dict(
+            name=f'Node {curie}',
+            categories=['biolink:NamedThing'],
+            attributes=[
+                dict(attribute_type_id='biolink:same_as', value=[curie, f'{curie}.alt']),
+                dict(attribute_type_id='biolink:synonym', value=[f'Synonym of {curie}']),
+                dict(attribute_type_id='biolink:description', value=f'Description of {curie}'),
+                dict(attribute_type_id='biolink:publications', value=pmids()),
+                *filler_attributes(),
+            ],
+        )
+
+    def make_edge(subject, obj, predicate, attributes=()):
+        return dict(
+            subject=subject,
+            object=obj,
+            predicate=predicate,
+            sources=SOURCES,
+            attributes=[
+                dict(attribute_type_id='biolink:publications', value=pmids()),
+                *attributes,
+                *filler_attributes(),
+            ],
+        )
+
+    edges = {}
+    aux_graphs = {}
+    results = []
+    drugs = [node_ids[i % n_nodes] for i in range(n_results)]
+    for i, drug in enumerate(drugs):
+        if creative:
+            sg_ids = []
+            for j in range(n_support_graphs):
+                path = [drug] + rnd.sample(node_ids, support_graph_length - 1) + [DISEASE]
+                sg_edge_ids = []
+                for k, (subject, obj) in enumerate(zip(path, path[1:])):
+                    seid = f'sg{i}_{j}_{k}'
+                    edges[seid] = make_edge(subject, obj, rnd.choice(PREDICATES))
+                    sg_edge_ids.append(seid)
+                sgid = f'sg{i}_{j}'
+                aux_graphs[sgid] = dict(edges=sg_edge_ids, attributes=[])
+                sg_ids.append(sgid)
+
+            eid = f'inferred_{i}'
+            edges[eid] = make_edge(
+                drug, DISEASE, 'biolink:treats',
+                [dict(attribute_type_id='biolink:support_graphs', value=sg_ids)],
+            )
+            edge_bindings = dict(t_edge=[dict(id=eid, attributes=[])])
+        else:
+            # Spread the edges over the results, at least one per result
+            n_result_edges = max(1, n_edges // n_results + (i < n_edges % n_results))
+            edge_ids = []
+            for k in range(n_result_edges):
+                eid = f'e{i}_{k}'
+                edges[eid] = make_edge(drug, DISEASE, 'biolink:treats' if k == 0 else rnd.choice(PREDICATES))
+                edge_ids.append(eid)
+            edge_bindings = dict(e0=[dict(id=eid, attributes=[]) for eid in edge_ids])
+
+        results.append(dict(
+            node_bindings=dict(n0=[dict(id=drug, attributes=[])], n1=[dict(id=DISEASE, attributes=[])]),
+            analyses=[dict(resource_id='infores:benchmark', score=rnd.random(), edge_bindings=edge_bindings)],
+        ))
+
+    return dict(message=dict(
+        query_graph=make_query_graph(creative),
+        knowledge_graph=dict(nodes=nodes, edges=edges),
+        auxiliary_graphs=aux_graphs,
+        results=results,
+    ))
@@ -1,84 +1,414 @@
+import asyncio
+import json
+import logging
 import warnings
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
 
 import openai
-import tiktoken
 import kg_summarizer.config as CFG
+from kg_summarizer.cache import SqliteCache
+from kg_summarizer.metrics import track_upstream, record_llm_usage, record_llm_cache_hit
+from kg_summarizer.tokens import count_tokens, estimate_tokens, prompt_token_budget, pack_token_budget
 
 openai.organization = CFG.ENV['OPENAI_ORGANIZATION_ID']
 openai.api_key = CFG.ENV['OPENAI_API_KEY']
+if CFG.OPENAI_API_BASE:
+    openai.api_base = CFG.OPENAI_API_BASE
 
-# https://openai.com/pricing   
-# https://platform.openai.com/docs/models/gpt-3-5
-OPENAI_MODEL_LIMITS = {
-    'gpt-3.5-turbo': {
-        'max_tokens': 4096,
-        'input_price_per_1k_tokens': 0.0015,
-        'output_price_per_1k_tokens': 0.002,
-    },
-    'gpt-3.5-turbo-16k': {
-        'max_tokens': 16384,
-        'input_price_per_1k_tokens': 0.003,
-        'output_price_per_1k_tokens': 0.004,
-    },
-    'gpt-4': {
-        'max_tokens': 8192,
-        'input_price_per_1k_tokens': 0.03,
-        'output_price_per_1k_tokens': 0.06,
-    },
-    'gpt-4-32k': {
-        'max_tokens': 32768,
-        'input_price_per_1k_tokens': 0.06,
-        'output_price_per_1k_tokens': 0.12,
-    },
-}
-
+logger = logging.getLogger(__name__)
 
 def num_tokens_from_string(string, model_name):
-    encoding = tiktoken.encoding_for_model(model_name)
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
+    return count_tokens([string], model_name)[0]
 
 def check_token_count_and_price(string, model_name, verbose=True):
-    price_per_1k_tokens = OPENAI_MODEL_LIMITS[model_name]['input_price_per_1k_tokens']
-    max_tokens = OPENAI_MODEL_LIMITS[model_name]['max_tokens']
+    estimate = estimate_tokens([string], model_name)
+    num_tokens, max_tokens, cost = estimate.total, estimate.max_tokens, estimate.input_cost
 
-    num_tokens = num_tokens_from_string(string, model_name)
-    if num_tokens > max_tokens:
+    if estimate.exceeds_limit:
         warnings.warn(f"Number of tokens ({num_tokens}) exceeds model max tokens ({max_tokens}).")
 
-    cost = (num_tokens / 1000) * price_per_1k_tokens
     if verbose:
         print(f"Token Count: [{num_tokens}/{max_tokens}]\nPrice: ${cost:.6f}")
 
     return num_tokens, cost
 
-def generate_response(system_prompt, user_prompt, model='gpt-3.5-turbo', temperature=0.0):
+# Bump when a prompt template changes so cached completions of the old prompts aren't reused
+PROMPT_TEMPLATE_VERSION = 1
+
+COMPLETION_CACHE = SqliteCache(
+    CFG.CACHE_DIR / 'completions.sqlite',
+    ttl=CFG.COMPLETION_CACHE_TTL,
+    max_entries=CFG.COMPLETION_CACHE_MAX_ENTRIES,
+    compress=True,
+    memory_size=1000,
+)
+
+def completion_cache_key(model, temperature, messages):
+    key_data = dict(model=model, temperature=temperature, messages=messages, version=PROMPT_TEMPLATE_VERSION)
+    return sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+def get_cached_completion(key):
+    entry = COMPLETION_CACHE.get(key)
+    if entry is None:
+        return None
+
+    # Count what the cache hit saved
+    record_llm_cache_hit(entry['model'], entry['usage']['prompt_tokens'], entry['usage']['completion_tokens'])
+    return entry['response']
+
+def set_cached_completion(key, model, completions):
+    COMPLETION_CACHE.set(key, dict(
+        model=model,
+        response=completions.choices[0].message.content,
+        usage=dict(
+            prompt_tokens=completions.usage.prompt_tokens,
+            completion_tokens=completions.usage.completion_tokens,
+        ),
+    ))
+
+def generate_response(system_prompt, user_prompt, model='gpt-3.5-turbo', temperature=0.0, timeout=CFG.OPENAI_REQUEST_TIMEOUT, use_cache=None):
+    """
+    use_cache: None caches temperature 0 (deterministic) completions only, True/False
+    force the completion cache on/off.
+    """
     messages = [
         {'role': 'system', 'content': system_prompt},
         {'role': 'user', 'content': user_prompt},
     ] 
 
+    use_cache = (temperature == 0) if use_cache is None else use_cache
+    if use_cache:
+        key = completion_cache_key(model, temperature, messages)
+        response = get_cached_completion(key)
+        if response is not None:
+            return response
+
     # Make a request to OpenAI
-    completions = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-        temperature=temperature
-    )
+    with track_upstream('openai'):
+        completions = openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            request_timeout=timeout,
+        )
+    record_llm_usage(model, completions.usage.prompt_tokens, completions.usage.completion_tokens)
     response = completions.choices[0].message.content
 
+    if use_cache:
+        set_cached_completion(key, model, completions)
+
     return response
 
-def general_summarize_abstracts(edge, statement):
-    system_prompt = f"""
-    You are a biomedical sciences researcher evaluating publication abstracts. You will be given a list of dictionaries with a PMID key and the associated abstract. Find evidence supporting the statement '{statement}' in the abstracts. Structure your response as bullet points starting with the PMID associated with the supporting evidence. List multiple PMIDs if you find related evidence from multiple publications.
+# Limits concurrent OpenAI requests across all async callers of an event loop (a semaphore
+# can't be shared between loops, e.g. successive asyncio.run calls)
+openai_semaphores = weakref.WeakKeyDictionary()
+
+def get_openai_semaphore():
+    loop = asyncio.get_running_loop()
+    if loop not in openai_semaphores:
+        openai_semaphores[loop] = asyncio.Semaphore(CFG.OPENAI_MAX_CONCURRENCY)
+    return openai_semaphores[loop]
+
+async def agenerate_response(system_prompt, user_prompt, model='gpt-3.5-turbo', temperature=0.0, timeout=CFG.OPENAI_REQUEST_TIMEOUT, use_cache=None):
+    """
+    Async twin of generate_response, waits for a slot in the global concurrency limit and
+    raises asyncio.TimeoutError when the request takes longer than `timeout` seconds.
+    """
+    messages = [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': user_prompt},
+    ]
+
+    use_cache = (temperature == 0) if use_cache is None else use_cache
+    if use_cache:
+        key = completion_cache_key(model, temperature, messages)
+        # SQLite reads (and writes below) can block on other workers, keep them off the event loop
+        response = await asyncio.to_thread(get_cached_completion, key)
+        if response is not None:
+            return response
+
+    async with get_openai_semaphore():
+        try:
+            with track_upstream('openai'):
+                completions = await asyncio.wait_for(
+                    openai.ChatCompletion.acreate(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        request_timeout=timeout,
+                    ),
+                    timeout,
+                )
+        except openai.error.Timeout as e:
+            raise asyncio.TimeoutError(str(e)) from e
+    record_llm_usage(model, completions.usage.prompt_tokens, completions.usage.completion_tokens)
+    response = completions.choices[0].message.content
+
+    if use_cache:
+        await asyncio.to_thread(set_cached_completion, key, model, completions)
+
+    return response
+
+# Bump when abstract_summary_prompt changes, stored summaries of older versions are ignored
+ABSTRACT_SUMMARY_VERSION = 1
+
+ABSTRACT_SUMMARY_STORE = SqliteCache(
+    CFG.CACHE_DIR / 'abstract_summaries.sqlite',
+    max_entries=CFG.ABSTRACT_SUMMARY_CACHE_MAX_ENTRIES,
+    compress=True,
+    memory_size=10000,
+)
+
+def abstract_summary_prompt():
+    return """
+    You are a pharmacology researcher summarizing publication abstracts. Condense the follow abstract to a single sentence.
+    """
+
+def abstract_summary_key(pubid):
+    return f"v{ABSTRACT_SUMMARY_VERSION}:{pubid}"
+
+def summarize_publications(publications, timeout=CFG.OPENAI_REQUEST_TIMEOUT):
+    """
+    Replaces the abstracts of a {pmid: abstract} list with one sentence summaries. Each abstract
+    is summarized once per prompt version and the summaries are shared by every edge and query.
+    Abstracts that fail to summarize are kept as is (and not stored).
+    """
+    publications = [(pubid, abstract) for pub in publications for pubid, abstract in pub.items()]
+    keys = {pubid: abstract_summary_key(pubid) for pubid, _ in publications}
+    stored = ABSTRACT_SUMMARY_STORE.get_many(keys.values())
+
+    missing = {pubid: abstract for pubid, abstract in publications if keys[pubid] not in stored}
+    def summarize(pub):
+        try:
+            return generate_response(
+                abstract_summary_prompt(), pub[1], model=CFG.ABSTRACT_SUMMARY_MODEL, timeout=timeout, use_cache=False
+            )
+        except openai.error.OpenAIError as e:
+            logger.warning(f"Summarizing {pub[0]} failed: {e}")
+            return None
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=CFG.OPENAI_MAX_CONCURRENCY) as executor:
+            summaries = dict(zip(missing, executor.map(summarize, missing.items())))
+        new = {keys[pubid]: summary for pubid, summary in summaries.items() if summary is not None}
+        ABSTRACT_SUMMARY_STORE.set_many(new)
+        stored.update(new)
+
+    return [{pubid: stored.get(keys[pubid], abstract)} for pubid, abstract in publications]
+
+# Abstract summaries being looked up or generated per event loop, {store key: future}. The
+# edges of a /summarize/edges request cite many of the same PMIDs and are summarized at once,
+# they wait for the first caller of a PMID instead of all missing the store and summarizing it.
+abstract_summary_futures = weakref.WeakKeyDictionary()
+
+def get_abstract_summary_futures():
+    return abstract_summary_futures.setdefault(asyncio.get_running_loop(), {})
+
+async def asummarize_publications(publications, timeout=CFG.OPENAI_REQUEST_TIMEOUT):
+    publications = [(pubid, abstract) for pub in publications for pubid, abstract in pub.items()]
+    abstracts = dict(publications)
+    keys = {pubid: abstract_summary_key(pubid) for pubid in abstracts}
+
+    # Claim the keys nobody is working on, from the store lookup until the new summaries are stored
+    futures = get_abstract_summary_futures()
+    owned = {}
+    for pubid, key in keys.items():
+        if key not in futures:
+            owned[pubid] = futures[key] = asyncio.get_running_loop().create_future()
+    waiting = {pubid: futures[keys[pubid]] for pubid in keys if pubid not in owned}
+
+    stored = {}
+    try:
+        stored = await asyncio.to_thread(ABSTRACT_SUMMARY_STORE.get_many, [keys[pubid] for pubid in owned])
+        missing = [pubid for pubid in owned if keys[pubid] not in stored]
+        summaries = await asyncio.gather(*[
+            agenerate_response(
+                abstract_summary_prompt(), abstracts[pubid], model=CFG.ABSTRACT_SUMMARY_MODEL, timeout=timeout,
+                use_cache=False,
+            )
+            for pubid in missing
+        ], return_exceptions=True)
+
+        new = {}
+        for pubid, summary in zip(missing, summaries):
+            if isinstance(summary, (openai.error.OpenAIError, asyncio.TimeoutError)):
+                logger.warning(f"Summarizing {pubid} failed: {summary!r}")
+            elif isinstance(summary, BaseException):
+                raise summary
+            else:
+                new[keys[pubid]] = summary
+        if new:
+            await asyncio.to_thread(ABSTRACT_SUMMARY_STORE.set_many, new)
+        stored.update(new)
+    finally:
+        # None (keep the abstract) for summaries that failed
+        for pubid, future in owned.items():
+            future.set_result(stored.get(keys[pubid]))
+            del futures[keys[pubid]]
+
+    # Shielded so a cancelled caller doesn't cancel the summary for the others
+    summaries = dict(zip(waiting, await asyncio.gather(*[asyncio.shield(future) for future in waiting.values()])))
+    summaries.update((pubid, stored.get(keys[pubid])) for pubid in owned)
+    return [{pubid: summaries[pubid] or abstract} for pubid, abstract in publications]
+
+def abstract_pack_prompt():
+    return """
+    You are a pharmacology researcher summarizing publication abstracts. You will be given a JSON object mapping PMIDs to abstracts. Condense each abstract to a single sentence. Respond only with a JSON object mapping every PMID to its single sentence summary.
+    """
+
+def parse_abstract_pack(response):
+    # Models sometimes wrap JSON in a markdown code block
+    response = response.strip()
+    if response.startswith('```'):
+        response = response.strip('`').removeprefix('json').strip()
+    summaries = json.loads(response)
+    if not isinstance(summaries, dict):
+        raise ValueError('Expected a JSON object of PMID summaries')
+    return summaries
+
+def pack_abstracts(abstracts, model):
     """
+    Splits a {pmid: abstract} dict into packs that fit one batch prompt (and whose summaries fit
+    in the completion).
+    """
+    pmids = list(abstracts)
+    budget = prompt_token_budget(model, abstract_pack_prompt(), CFG.SUMMARY_COMPLETION_TOKENS)
+    counts = count_tokens([json.dumps({pmid: abstracts[pmid]}) for pmid in pmids], model)
+    batches = pack_token_budget(counts, budget, max_items=CFG.ABSTRACT_PACK_SIZE)
+    return [{pmids[idx]: abstracts[pmids[idx]] for idx in batch} for batch in batches]
+
+async def asummarize_abstract_batch(abstracts, model='gpt-3.5-turbo', temperature=0.0, use_cache=None):
+    """
+    Condenses a {pmid: abstract} dict to one sentence per abstract with several abstracts per
+    completion, the packs run concurrently. Returns {pmid: {'summary': ...}} or
+    {pmid: {'error': ...}} for every PMID, a failed pack is retried one abstract at a time so
+    errors stay isolated to the items that cause them.
+    """
+    kwargs = dict(model=model, temperature=temperature, use_cache=use_cache)
+
+    async def summarize_one(pmid, abstract):
+        try:
+            return {'summary': await agenerate_response(abstract_summary_prompt(), abstract, **kwargs)}
+        except asyncio.TimeoutError:
+            return {'error': 'OpenAI request timed out'}
+        except openai.error.OpenAIError as e:
+            return {'error': str(e)}
+        except Exception as e:
+            logger.exception(f"Failed to summarize abstract {pmid}")
+            return {'error': f'{type(e).__name__}: {e}'}
 
-    text = generate_response(system_prompt, str(edge['publications']), model='gpt-3.5-turbo-16k')
+    async def summarize_pack(pack):
+        if len(pack) == 1:
+            pmid, abstract = next(iter(pack.items()))
+            return {pmid: await summarize_one(pmid, abstract)}
 
-    system_prompt = f"""
+        try:
+            summaries = parse_abstract_pack(await agenerate_response(abstract_pack_prompt(), json.dumps(pack), **kwargs))
+        except Exception as e:
+            # Retried one abstract at a time below
+            logger.warning(f"Abstract pack of {len(pack)} failed: {type(e).__name__}: {e}")
+            summaries = {}
+
+        results = {pmid: {'summary': summaries[pmid]} for pmid in pack if isinstance(summaries.get(pmid), str)}
+        missing = [pmid for pmid in pack if pmid not in results]
+        retried = await asyncio.gather(*[summarize_one(pmid, pack[pmid]) for pmid in missing])
+        results.update(zip(missing, retried))
+        return results
+
+    results = {pmid: {'error': 'Empty abstract'} for pmid, abstract in abstracts.items() if not abstract.strip()}
+    to_summarize = {pmid: abstract for pmid, abstract in abstracts.items() if pmid not in results}
+    try:
+        packs = pack_abstracts(to_summarize, model)
+    except Exception:
+        # e.g. the tokenizer failing, summarize one abstract per completion instead
+        logger.exception(f"Failed to pack {len(to_summarize)} abstracts")
+        packs = [{pmid: abstract} for pmid, abstract in to_summarize.items()]
+
+    for pack_results in await asyncio.gather(*[summarize_pack(pack) for pack in packs]):
+        results.update(pack_results)
+    return {pmid: results[pmid] for pmid in abstracts}
+
+def evidence_prompt(statement):
+    return f"""
+    You are a biomedical sciences researcher evaluating publication abstracts. You will be given a list of dictionaries with a PMID key and the associated abstract. Find evidence supporting the statement '{statement}' in the abstracts. Structure your response as bullet points starting with the PMID associated with the supporting evidence. List multiple PMIDs if you find related evidence from multiple publications.
+    """
+
+def grouping_prompt(text):
+    return f"""
     Read the following list of abstract summaries. Group summaries that have similar conclusions. Structure your response as bullet points beginning with a comma separated list of grouped summaries followed the the main idea of the grouped summaries. 
 
     Abstract summary list: '{text}'
     """
 
-    return generate_response(system_prompt, '', model='gpt-3.5-turbo-16k'), text
\ No newline at end of file
+def chunk_publications(publications, statement, model):
+    """
+    Splits the {pmid: abstract} list into chunks that fit in one evidence prompt of the model.
+    """
+    publications = list(publications)
+    budget = prompt_token_budget(model, evidence_prompt(statement), CFG.SUMMARY_COMPLETION_TOKENS)
+    counts = count_tokens([str(pub) for pub in publications], model)
+    for pub, n_tokens in zip(publications, counts):
+        if (budget is not None) and (n_tokens > budget):
+            warnings.warn(f"Publication {list(pub)[0]} ({n_tokens} tokens) exceeds the prompt budget ({budget}).")
+
+    chunks = [[publications[idx] for idx in batch] for batch in pack_token_budget(counts, budget, item_overhead=2)]
+    return chunks or [[]]
+
+def grouping_batches(texts, model):
+    """
+    Groups partial summaries into batches that fit in one grouping prompt. Falls back to pairs
+    when every summary needs a batch of its own so each reduce level still shrinks.
+    """
+    budget = prompt_token_budget(model, grouping_prompt(''), CFG.SUMMARY_COMPLETION_TOKENS)
+    batches = pack_token_budget(count_tokens(texts, model), budget, item_overhead=1)
+    if len(texts) > 1 and len(batches) == len(texts):
+        batches = [list(range(idx, min(idx + 2, len(texts)))) for idx in range(0, len(texts), 2)]
+    return [[texts[idx] for idx in batch] for batch in batches]
+
+def general_summarize_abstracts(edge, statement, model='gpt-3.5-turbo-16k', temperature=0.0, use_cache=None, condense=True):
+    """
+    Map-reduce summary of the edge publications: the evidence prompt runs in parallel over
+    token-budgeted chunks of abstracts, then the grouping prompt is applied hierarchically
+    until the partial summaries fit in a single call.
+
+    condense: work from the stored one sentence summary of each abstract instead of the full text
+    """
+    kwargs = dict(model=model, temperature=temperature, use_cache=use_cache)
+    publications = summarize_publications(edge['publications']) if condense else edge['publications']
+    chunks = chunk_publications(publications, statement, model)
+
+    with ThreadPoolExecutor(max_workers=CFG.OPENAI_MAX_CONCURRENCY) as executor:
+        texts = list(executor.map(
+            lambda chunk: generate_response(evidence_prompt(statement), str(chunk), **kwargs), chunks
+        ))
+        text = '\n'.join(texts)
+
+        batches = grouping_batches(texts, model)
+        while len(batches) > 1:
+            texts = list(executor.map(
+                lambda batch: generate_response(grouping_prompt('\n'.join(batch)), '', **kwargs), batches
+            ))
+            batches = grouping_batches(texts, model)
+
+    return generate_response(grouping_prompt('\n'.join(batches[0])), '', **kwargs), text
+
+async def ageneral_summarize_abstracts(edge, statement, model='gpt-3.5-turbo-16k', temperature=0.0, use_cache=None, condense=True):
+    kwargs = dict(model=model, temperature=temperature, use_cache=use_cache)
+    publications = (await asummarize_publications(edge['publications'])) if condense else edge['publications']
+    chunks = chunk_publications(publications, statement, model)
+
+    texts = await asyncio.gather(*[
+        agenerate_response(evidence_prompt(statement), str(chunk), **kwargs) for chunk in chunks
+    ])
+    text = '\n'.join(texts)
+
+    batches = grouping_batches(texts, model)
+    while len(batches) > 1:
+        texts = await asyncio.gather(*[
+            agenerate_response(grouping_prompt('\n'.join(batch)), '', **kwargs) for batch in batches
+        ])
+        batches = grouping_batches(texts, model)
+
+    return await agenerate_response(grouping_prompt('\n'.join(batches[0])), '', **kwargs), text
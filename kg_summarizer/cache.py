@@ -0,0 +1,336 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import zlib
+from pathlib import Path
+from time import time
+
+from cachetools import LRUCache
+
+from kg_summarizer.metrics import record_cache_lookups
+
+SQLITE_MAX_VARS = 500
+
+
+class SqliteCache:
+    """
+    JSON key/value cache stored in a single SQLite file. The database runs in WAL mode so
+    several processes (e.g. uvicorn workers) can read and write it at the same time.
+
+    Every entry has its own expiry time, the least recently used entries are evicted once
+    max_entries or max_bytes is exceeded, and an optional in-process LRU (memory_size)
+    serves hot keys without touching the disk. A value of None is a valid (negative) entry,
+    use `key in cache.get_many(...)` to tell it apart from a miss.
+    """
+
+    def __init__(self, path, ttl=None, max_entries=None, max_bytes=None, compress=False,
+                 memory_size=0, evict_every=1000, name=None):
+        self.path = str(path)
+        # Label of the cache in the metrics
+        self.name = name or Path(path).stem
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = LRUCache(maxsize=memory_size) if memory_size else None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._n_writes = 0
+
+    @property
+    def conn(self):
+        # sqlite connections can't be shared across threads or forked processes
+        conn = getattr(self._local, 'conn', None)
+        if (conn is None) or (self._local.pid != os.getpid()):
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB, compressed INTEGER, size INTEGER, '
+                'expires_at REAL, accessed_at REAL)'
+            )
+            # Covers the eviction queries so they don't read the (possibly large) values
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_eviction ON cache (accessed_at, size, key)')
+            conn.execute('DROP INDEX IF EXISTS cache_accessed_at')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def encode(self, value):
+        blob = json.dumps(value).encode('utf-8')
+        if self.compress:
+            return zlib.compress(blob), 1
+        return blob, 0
+
+    @staticmethod
+    def decode(blob, compressed):
+        if compressed:
+            blob = zlib.decompress(blob)
+        return json.loads(blob)
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        now = time()
+        found = {}
+
+        if self._memory is not None:
+            with self._lock:
+                for key in keys:
+                    entry = self._memory.get(key)
+                    if entry is None:
+                        continue
+                    value, expires_at = entry
+                    if (expires_at is None) or (expires_at > now):
+                        found[key] = value
+                    else:
+                        del self._memory[key]
+
+        disk_keys = [key for key in keys if key not in found]
+        if self._memory is not None:
+            record_cache_lookups(self.name, 'memory', len(found), len(disk_keys))
+        for chunk_start in range(0, len(disk_keys), SQLITE_MAX_VARS):
+            chunk = disk_keys[chunk_start:chunk_start + SQLITE_MAX_VARS]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f'SELECT key, value, compressed, expires_at FROM cache WHERE key IN ({placeholders})', chunk
+            ).fetchall()
+
+            hit_keys = []
+            for key, blob, compressed, expires_at in rows:
+                if (expires_at is not None) and (expires_at <= now):
+                    continue
+                found[key] = self.decode(blob, compressed)
+                hit_keys.append(key)
+                self._remember(key, found[key], expires_at)
+
+            if hit_keys:
+                placeholders = ','.join('?' * len(hit_keys))
+                self.conn.execute(f'UPDATE cache SET accessed_at = ? WHERE key IN ({placeholders})', [now, *hit_keys])
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        record_cache_lookups(self.name, 'disk', len(found) - (len(keys) - len(disk_keys)), len(keys) - len(found))
+        return found
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl=ttl)
+
+    def set_many(self, items, ttl=None):
+        if not items:
+            return
+
+        now = time()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = None if ttl is None else now + ttl
+
+        rows = []
+        for key, value in items.items():
+            blob, compressed = self.encode(value)
+            rows.append((key, blob, compressed, len(blob), expires_at, now))
+            self._remember(key, value, expires_at)
+
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        self._count_writes(len(rows))
+
+    def set_file(self, key, json_file, ttl=None, chunk_size=1 << 20):
+        """
+        Stores a JSON document from a binary file without parsing it. The (compressed) bytes
+        are staged in a temporary file and written into the database chunk by chunk, so memory
+        use doesn't grow with the document.
+        """
+        now = time()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = None if ttl is None else now + ttl
+
+        compressor = zlib.compressobj() if self.compress else None
+        with tempfile.TemporaryFile() as staged:
+            for data in iter(lambda: json_file.read(chunk_size), b''):
+                staged.write(compressor.compress(data) if compressor else data)
+            if compressor:
+                staged.write(compressor.flush())
+            size = staged.tell()
+            staged.seek(0)
+
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rowid = conn.execute(
+                    'INSERT OR REPLACE INTO cache VALUES (?, zeroblob(?), ?, ?, ?, ?)',
+                    (key, size, int(self.compress), size, expires_at, now)
+                ).lastrowid
+                if hasattr(conn, 'blobopen'):
+                    with conn.blobopen('cache', 'value', rowid) as blob:
+                        for data in iter(lambda: staged.read(chunk_size), b''):
+                            blob.write(data)
+                else:
+                    # No incremental blob I/O before Python 3.11
+                    conn.execute('UPDATE cache SET value = ? WHERE rowid = ?', (staged.read(), rowid))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+        self._count_writes(1)
+
+    def open_file(self, key, chunk_size=1 << 20):
+        """
+        Returns the JSON document of an entry as a seekable binary temporary file (or None
+        on a miss) so large values can be parsed incrementally. The stored bytes are read
+        chunk by chunk.
+        """
+        now = time()
+        conn = self.conn
+        row = conn.execute(
+            'SELECT rowid, compressed FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)', (key, now)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            record_cache_lookups(self.name, 'disk', 0, 1)
+            return None
+        self.hits += 1
+        record_cache_lookups(self.name, 'disk', 1, 0)
+        conn.execute('UPDATE cache SET accessed_at = ? WHERE key = ?', (now, key))
+
+        rowid, compressed = row
+        json_file = tempfile.TemporaryFile()
+        decompressor = zlib.decompressobj() if compressed else None
+        for data in self._read_blob(rowid, chunk_size):
+            json_file.write(decompressor.decompress(data) if decompressor else data)
+        if decompressor:
+            json_file.write(decompressor.flush())
+        json_file.seek(0)
+        return json_file
+
+    def _read_blob(self, rowid, chunk_size):
+        conn = self.conn
+        if not hasattr(conn, 'blobopen'):
+            # No incremental blob I/O before Python 3.11
+            yield conn.execute('SELECT value FROM cache WHERE rowid = ?', (rowid,)).fetchone()[0]
+            return
+        with conn.blobopen('cache', 'value', rowid, readonly=True) as blob:
+            for data in iter(lambda: blob.read(chunk_size), b''):
+                yield data
+
+    def _count_writes(self, n_writes):
+        # Eviction scans the whole table, only run it every evict_every written entries
+        self._n_writes += n_writes
+        if self._n_writes >= self.evict_every:
+            self._n_writes = 0
+            self.evict()
+
+    def _remember(self, key, value, expires_at):
+        if self._memory is not None:
+            with self._lock:
+                self._memory[key] = (value, expires_at)
+
+    def delete(self, keys):
+        keys = list(keys)
+        if self._memory is not None:
+            with self._lock:
+                for key in keys:
+                    self._memory.pop(key, None)
+        for chunk_start in range(0, len(keys), SQLITE_MAX_VARS):
+            chunk = keys[chunk_start:chunk_start + SQLITE_MAX_VARS]
+            placeholders = ','.join('?' * len(chunk))
+            self.conn.execute(f'DELETE FROM cache WHERE key IN ({placeholders})', chunk)
+
+    def clear(self):
+        if self._memory is not None:
+            with self._lock:
+                self._memory.clear()
+        self.conn.execute('DELETE FROM cache')
+
+    def evict(self):
+        """
+        Removes expired entries, then least recently used entries until the cache fits
+        within max_entries and max_bytes.
+        """
+        conn = self.conn
+        conn.execute('DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?', (time(),))
+
+        if self.max_entries is not None:
+            conn.execute(
+                'DELETE FROM cache WHERE key IN '
+                '(SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+        if self.max_bytes is not None:
+            total_bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+            if total_bytes > self.max_bytes:
+                evict_keys = []
+                for key, size in conn.execute('SELECT key, size FROM cache ORDER BY accessed_at ASC'):
+                    evict_keys.append(key)
+                    total_bytes -= size
+                    if total_bytes <= self.max_bytes:
+                        break
+                self.delete(evict_keys)
+
+    def stats(self):
+        n_entries, total_bytes = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache').fetchone()
+        return dict(hits=self.hits, misses=self.misses, entries=n_entries, bytes=total_bytes)
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+class DirectoryCache:
+    """
+    Text cache with one file per key in a directory (the original pubmed_abstracts
+    layout). Has the same get/set interface as SqliteCache but no expiry or eviction.
+    """
+
+    def __init__(self, path, suffix='.txt', name=None):
+        self.path = Path(path)
+        self.name = name or self.path.name
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        self.path.mkdir(parents=True, exist_ok=True)
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for key in keys:
+            cache_file = self.path / f"{key}{self.suffix}"
+            if cache_file.exists():
+                with open(cache_file, "r", encoding="utf-8") as file:
+                    found[key] = file.read()
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        record_cache_lookups(self.name, 'disk', len(found), len(keys) - len(found))
+        return found
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value})
+
+    def set_many(self, items, ttl=None):
+        self.path.mkdir(parents=True, exist_ok=True)
+        for key, value in items.items():
+            with open(self.path / f"{key}{self.suffix}", "w", encoding="utf-8") as file:
+                file.write(value)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, entries=len(list(self.path.glob(f"*{self.suffix}"))))
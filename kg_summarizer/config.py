@@ -2,6 +2,72 @@ from pathlib import Path
 from dotenv import dotenv_values
 
 PROJ_DIR = Path(__file__).parents[1]
-CACHE_DIR = PROJ_DIR / 'cache'
+ENV = dotenv_values(PROJ_DIR / '.env')
+CACHE_DIR = Path(ENV.get('CACHE_DIR', PROJ_DIR / 'cache'))
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
-ENV = dotenv_values(PROJ_DIR / '.env')
\ No newline at end of file
+
+# Upstream services, override to use mirrors or the local stubs of benchmarks/
+NODE_NORM_URL = ENV.get('NODE_NORM_URL', 'https://nodenormalization-sri.renci.org/1.3/get_normalized_nodes')
+EFETCH_URL = ENV.get('EFETCH_URL', 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi')
+ARAGORN_BASE_URL = ENV.get('ARAGORN_BASE_URL', 'https://aragorn.renci.org')
+STRIDER_URL = ENV.get('STRIDER_URL', 'https://strider.renci.org/1.4/query/')
+OPENAI_API_BASE = ENV.get('OPENAI_API_BASE')
+
+# Node normalization cache, shared by all workers through CACHE_DIR
+NODE_NORM_CACHE_TTL = int(ENV.get('NODE_NORM_CACHE_TTL', 7 * 24 * 3600))
+NODE_NORM_CACHE_NEGATIVE_TTL = int(ENV.get('NODE_NORM_CACHE_NEGATIVE_TTL', 24 * 3600))
+NODE_NORM_CACHE_MAX_ENTRIES = int(ENV.get('NODE_NORM_CACHE_MAX_ENTRIES', 1_000_000))
+NODE_NORM_CACHE_MEMORY_SIZE = int(ENV.get('NODE_NORM_CACHE_MEMORY_SIZE', 50_000))
+
+# PubMed abstract store: 'sqlite' (single indexed file) or 'files' (one file per abstract)
+PUBMED_CACHE_BACKEND = ENV.get('PUBMED_CACHE_BACKEND', 'sqlite')
+PUBMED_CACHE_COMPRESS = ENV.get('PUBMED_CACHE_COMPRESS', 'true').lower() == 'true'
+
+# NCBI allows 3 requests/second without an API key and 10 with one
+NCBI_API_KEY = ENV.get('NCBI_API_KEY')
+PUBMED_MAX_IN_FLIGHT = int(ENV.get('PUBMED_MAX_IN_FLIGHT', 10))
+PUBMED_REQUESTS_PER_SECOND = float(ENV.get('PUBMED_REQUESTS_PER_SECOND', 10 if NCBI_API_KEY else 3))
+# First efetch retry delay in seconds (doubles per retry) when NCBI sends no Retry-After
+PUBMED_RETRY_BACKOFF = float(ENV.get('PUBMED_RETRY_BACKOFF', 1))
+
+# Shared HTTP transport (kg_summarizer.transport)
+HTTP_POOL_CONNECTIONS = int(ENV.get('HTTP_POOL_CONNECTIONS', 10)) # number of hosts to keep pools for
+HTTP_POOL_MAXSIZE = int(ENV.get('HTTP_POOL_MAXSIZE', 20)) # keep-alive connections per host
+HTTP_CONNECT_TIMEOUT = float(ENV.get('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT = float(ENV.get('HTTP_READ_TIMEOUT', 60))
+HTTP2 = ENV.get('HTTP2', 'false').lower() == 'true'
+TRAPI_READ_TIMEOUT = float(ENV.get('TRAPI_READ_TIMEOUT', 900))
+
+# TRAPI query response cache
+QUERY_CACHE_TTL = int(ENV.get('QUERY_CACHE_TTL', 7 * 24 * 3600))
+QUERY_CACHE_MAX_BYTES = int(ENV.get('QUERY_CACHE_MAX_BYTES', 5 * 1024**3))
+
+# Async TRAPI queries. Set TRAPI_CALLBACK_BASE_URL to the public URL of this server to get
+# results pushed to /trapi/callback/{job_id}, otherwise the ARA job status is polled.
+TRAPI_CALLBACK_BASE_URL = ENV.get('TRAPI_CALLBACK_BASE_URL')
+ASYNC_QUERY_POLL_INTERVAL = float(ENV.get('ASYNC_QUERY_POLL_INTERVAL', 10))
+ASYNC_QUERY_TIMEOUT = float(ENV.get('ASYNC_QUERY_TIMEOUT', 3600))
+
+# Per-target deadline when fanning a query out to several ARAs
+FANOUT_TIMEOUT = float(ENV.get('FANOUT_TIMEOUT', 600))
+
+# OpenAI calls: max concurrent requests per process and per-request timeout (seconds)
+OPENAI_MAX_CONCURRENCY = int(ENV.get('OPENAI_MAX_CONCURRENCY', 8))
+OPENAI_REQUEST_TIMEOUT = float(ENV.get('OPENAI_REQUEST_TIMEOUT', 120))
+
+# LLM completion cache, used by default for temperature 0 calls only
+COMPLETION_CACHE_TTL = int(ENV.get('COMPLETION_CACHE_TTL', 30 * 24 * 3600))
+COMPLETION_CACHE_MAX_ENTRIES = int(ENV.get('COMPLETION_CACHE_MAX_ENTRIES', 200_000))
+
+# Tokens reserved for the completion when splitting prompts to fit the model context
+SUMMARY_COMPLETION_TOKENS = int(ENV.get('SUMMARY_COMPLETION_TOKENS', 1024))
+
+# One sentence abstract summaries, stored per PMID and prompt version
+ABSTRACT_SUMMARY_MODEL = ENV.get('ABSTRACT_SUMMARY_MODEL', 'gpt-3.5-turbo')
+ABSTRACT_SUMMARY_CACHE_MAX_ENTRIES = int(ENV.get('ABSTRACT_SUMMARY_CACHE_MAX_ENTRIES', 1_000_000))
+
+# Max abstracts packed into one completion by the batch summarization endpoint
+ABSTRACT_PACK_SIZE = int(ENV.get('ABSTRACT_PACK_SIZE', 10))
+
+# Emit OpenTelemetry spans for container stages and upstream calls (needs an SDK/exporter to go anywhere)
+OTEL_TRACING = ENV.get('OTEL_TRACING', 'false').lower() == 'true'
@@ -0,0 +1,74 @@
+from collections import defaultdict
+
+
+class KnowledgeGraphIndex:
+    """
+    One-time indexes over a TRAPI message so lookups don't rescan the knowledge graph:
+    attributes grouped by attribute_type_id per node and per edge, node -> incident
+    edges, edge -> auxiliary graphs containing it and PMID -> edges citing it.
+    """
+
+    def __init__(self, message):
+        kg = message['knowledge_graph']
+        aux_graphs = message.get('auxiliary_graphs') or {}
+
+        self.node_attrs = {nid: group_attributes(node.get('attributes')) for nid, node in kg['nodes'].items()}
+        self.edge_attrs = {}
+
+        node_edges = defaultdict(set)
+        pmid_edges = defaultdict(set)
+        for eid, edge in kg['edges'].items():
+            self.edge_attrs[eid] = group_attributes(edge.get('attributes'))
+            node_edges[edge['subject']].add(eid)
+            node_edges[edge['object']].add(eid)
+            for pubid in self.edge_values(eid, 'biolink:publications'):
+                pmid_edges[pubid].add(eid)
+
+        edge_aux_graphs = defaultdict(set)
+        for sgid, aux_graph in aux_graphs.items():
+            for eid in aux_graph['edges']:
+                edge_aux_graphs[eid].add(sgid)
+
+        self.node_edges = dict(node_edges)
+        self.pmid_edges = dict(pmid_edges)
+        self.edge_aux_graphs = dict(edge_aux_graphs)
+
+    def node_attributes(self, nid, type_id):
+        return self.node_attrs.get(nid, {}).get(type_id, [])
+
+    def edge_attributes(self, eid, type_id):
+        return self.edge_attrs.get(eid, {}).get(type_id, [])
+
+    def node_values(self, nid, type_id):
+        return attribute_values(self.node_attributes(nid, type_id))
+
+    def edge_values(self, eid, type_id):
+        return attribute_values(self.edge_attributes(eid, type_id))
+
+    def incident_edges(self, nid):
+        return self.node_edges.get(nid, set())
+
+    def citing_edges(self, pubid):
+        return self.pmid_edges.get(pubid, set())
+
+    def containing_aux_graphs(self, eid):
+        return self.edge_aux_graphs.get(eid, set())
+
+
+def group_attributes(attr_list_of_dicts):
+    grouped = defaultdict(list)
+    for attr_dict in attr_list_of_dicts or []:
+        grouped[attr_dict['attribute_type_id']].append(attr_dict)
+    return dict(grouped)
+
+
+def attribute_values(attr_list_of_dicts):
+    # Attribute values can be single values or lists, flatten both into one list
+    values = []
+    for attr_dict in attr_list_of_dicts:
+        value = attr_dict['value']
+        if isinstance(value, list):
+            values.extend(value)
+        else:
+            values.append(value)
+    return values
@@ -0,0 +1,107 @@
+"""
+Prometheus metrics of the service, exposed by the /metrics endpoint of kg_summarizer.server.
+
+Set PROMETHEUS_MULTIPROC_DIR (to an empty directory) when running several uvicorn workers so
+the endpoint aggregates the metrics of all of them.
+"""
+import os
+from contextlib import contextmanager
+from time import perf_counter
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+)
+
+from kg_summarizer.profiling import span
+from kg_summarizer.tokens import token_cost
+
+UPSTREAM_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+UPSTREAM_LATENCY = Histogram(
+    'kg_summarizer_upstream_request_seconds', 'Upstream request latency',
+    ['upstream'], buckets=UPSTREAM_LATENCY_BUCKETS,
+)
+UPSTREAM_ERRORS = Counter(
+    'kg_summarizer_upstream_errors_total', 'Upstream requests that raised an error', ['upstream'],
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    'kg_summarizer_upstream_in_flight', 'Upstream requests in progress', ['upstream'], multiprocess_mode='livesum',
+)
+
+REQUESTS = Counter(
+    'kg_summarizer_requests_total', 'HTTP requests handled', ['endpoint', 'method', 'status'],
+)
+REQUEST_LATENCY = Histogram(
+    'kg_summarizer_request_seconds', 'HTTP request latency (until the response starts)',
+    ['endpoint', 'method'], buckets=UPSTREAM_LATENCY_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'kg_summarizer_requests_in_flight', 'HTTP requests in progress', ['endpoint'], multiprocess_mode='livesum',
+)
+
+CACHE_REQUESTS = Counter(
+    'kg_summarizer_cache_requests_total', 'Cache lookups by cache, layer and result (hit/miss)',
+    ['cache', 'layer', 'result'],
+)
+
+LLM_TOKENS = Counter(
+    'kg_summarizer_llm_tokens_total', 'OpenAI tokens spent by model and type (prompt/completion)', ['model', 'type'],
+)
+LLM_COST = Counter(
+    'kg_summarizer_llm_cost_dollars_total', 'OpenAI spend in dollars by model, from OPENAI_MODEL_LIMITS prices', ['model'],
+)
+# Hits and misses of the completion cache are kg_summarizer_cache_requests_total{cache="completions"}
+LLM_CACHE_SAVED_TOKENS = Counter(
+    'kg_summarizer_llm_cache_saved_tokens_total', 'OpenAI tokens completion cache hits did not spend, by model and type',
+    ['model', 'type'],
+)
+LLM_CACHE_SAVED_COST = Counter(
+    'kg_summarizer_llm_cache_saved_dollars_total', 'OpenAI spend in dollars saved by completion cache hits', ['model'],
+)
+
+
+@contextmanager
+def track_upstream(upstream):
+    """
+    Times the block as one request to `upstream` (e.g. 'aragorn', 'node_normalizer', 'eutils',
+    'openai'), works around awaits as well. Also a profiling span named upstream.<upstream>.
+    """
+    in_flight = UPSTREAM_IN_FLIGHT.labels(upstream)
+    in_flight.inc()
+    start_time = perf_counter()
+    try:
+        with span(f'upstream.{upstream}'):
+            yield
+    except BaseException:
+        UPSTREAM_ERRORS.labels(upstream).inc()
+        raise
+    finally:
+        UPSTREAM_LATENCY.labels(upstream).observe(perf_counter() - start_time)
+        in_flight.dec()
+
+def record_cache_lookups(cache, layer, hits, misses):
+    if hits:
+        CACHE_REQUESTS.labels(cache, layer, 'hit').inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(cache, layer, 'miss').inc(misses)
+
+def record_llm_usage(model, prompt_tokens, completion_tokens):
+    LLM_TOKENS.labels(model, 'prompt').inc(prompt_tokens)
+    LLM_TOKENS.labels(model, 'completion').inc(completion_tokens)
+    LLM_COST.labels(model).inc(sum(token_cost(prompt_tokens, completion_tokens, model)))
+
+def record_llm_cache_hit(model, prompt_tokens, completion_tokens):
+    LLM_CACHE_SAVED_TOKENS.labels(model, 'prompt').inc(prompt_tokens)
+    LLM_CACHE_SAVED_TOKENS.labels(model, 'completion').inc(completion_tokens)
+    LLM_CACHE_SAVED_COST.labels(model).inc(sum(token_cost(prompt_tokens, completion_tokens, model)))
+
+def render_metrics():
+    """
+    Returns the (body, content type) of the Prometheus text exposition.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,124 @@
+"""
+Per-stage timing of GraphContainer construction and upstream calls.
+
+Stages run inside `span` blocks. Each block adds its wall time and call count to the active
+Profile (every GraphContainer has one, see GraphContainer.profile) and, with OTEL_TRACING on,
+becomes an OpenTelemetry span. Usage from the command line:
+
+    python -m kg_summarizer.profiling response.json [result_idx]
+"""
+import json
+import sys
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+from time import perf_counter
+
+from opentelemetry import trace
+
+import kg_summarizer.config as CFG
+
+tracer = trace.get_tracer('kg_summarizer')
+current_profile = ContextVar('current_profile', default=None)
+
+
+@dataclass
+class Stage:
+    calls: int = 0
+    seconds: float = 0.0
+    items: int = 0
+
+
+@dataclass
+class Profile:
+    stages: dict = field(default_factory=dict) # stage name -> Stage, in order of first use
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, name, seconds, items=None):
+        with self.lock:
+            stage = self.stages.setdefault(name, Stage())
+            stage.calls += 1
+            stage.seconds += seconds
+            stage.items += items or 0
+
+    def __getstate__(self):
+        # Locks can't be pickled (st.cache_data pickles the GraphContainer holding the profile)
+        return {name: value for name, value in self.__dict__.items() if name != 'lock'}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def as_dict(self):
+        return {
+            name: dict(calls=stage.calls, seconds=round(stage.seconds, 4), items=stage.items)
+            for name, stage in self.stages.items()
+        }
+
+    def report(self):
+        lines = [f"{'stage':<32} {'calls':>6} {'seconds':>9} {'items':>7}"]
+        for name, stage in self.stages.items():
+            lines.append(f"{name:<32} {stage.calls:>6} {stage.seconds:>9.3f} {stage.items:>7}")
+        return '\n'.join(lines)
+
+    def server_timing(self):
+        """
+        The profile as a Server-Timing header value (durations in milliseconds).
+        """
+        return ', '.join(
+            f'{name};dur={stage.seconds * 1000:.1f};desc="{stage.calls} calls, {stage.items} items"'
+            for name, stage in self.stages.items()
+        )
+
+
+@contextmanager
+def activate(profile):
+    token = current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        current_profile.reset(token)
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times the block as one call of stage `name`. The block may set attributes['items'] (e.g.
+    number of curies or PMIDs) to count the work done besides the time.
+    """
+    profile = current_profile.get()
+    otel_span = tracer.start_as_current_span(name) if CFG.OTEL_TRACING else nullcontext()
+    start_time = perf_counter()
+    try:
+        with otel_span as s:
+            yield attributes
+            if s is not None:
+                s.set_attributes({k: v for k, v in attributes.items() if v is not None})
+    finally:
+        if profile is not None:
+            profile.add(name, perf_counter() - start_time, attributes.get('items'))
+
+def profiled(name):
+    """
+    Method decorator running the method as stage `name` of the object's profile.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with activate(self.profile), span(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+if __name__ == '__main__':
+    from kg_summarizer.trapi import GraphContainer
+
+    with open(sys.argv[1], 'r', encoding='utf-8') as file:
+        response = json.load(file)
+    result_idx = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+    g = GraphContainer(response, verbose=False, result_idx=result_idx)
+    g.prefetch()
+    print(g.profile.report())
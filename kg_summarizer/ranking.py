@@ -0,0 +1,51 @@
+import heapq
+from collections.abc import Sequence
+
+
+def result_score(result, rank_by='score', reduce=max):
+    """
+    Score of a TRAPI result from the `rank_by` field of its analyses, combined with
+    `reduce` when there are several analyses. Results without the field rank last.
+    """
+    values = [analysis[rank_by] for analysis in result['analyses'] if analysis.get(rank_by) is not None]
+    return reduce(values) if values else float('-inf')
+
+
+class RankedResults(Sequence):
+    """
+    TRAPI results in descending score order without sorting all of them. Only the top k
+    are selected (O(n log k)) and k doubles when an index past the selection is requested.
+    """
+
+    def __init__(self, results, rank_by='score', reduce=max, k=10):
+        self.results = results
+        self.rank_by = rank_by
+        self.reduce = reduce
+        self.ranked = []
+        self.extend(k)
+
+    def key(self, result):
+        return result_score(result, rank_by=self.rank_by, reduce=self.reduce)
+
+    def extend(self, k):
+        k = min(k, len(self.results))
+        if k > len(self.ranked):
+            # nlargest keeps the original order of ties, same as a stable sort
+            self.ranked = heapq.nlargest(k, self.results, key=self.key)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            stop = len(self.results) if (idx.stop is None) or (idx.stop < 0) else idx.stop
+            self.extend(stop)
+        elif idx < 0:
+            self.extend(len(self.results))
+        elif idx >= len(self.ranked):
+            self.extend(max(idx + 1, 2 * len(self.ranked)))
+        return self.ranked[idx]
+
+    def __len__(self):
+        return len(self.results)
+
+    def __iter__(self):
+        for idx in range(len(self.results)):
+            yield self[idx]
@@ -1,15 +1,28 @@
-from fastapi import FastAPI
-from typing import Optional
+import asyncio
+import json
+import logging
+from time import perf_counter
+
+import aiohttp
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from typing import List, Optional
 from pydantic import BaseModel
+import openai
+from starlette.routing import Match
 
 from reasoner_pydantic import Response as PDResponse
 
+from kg_summarizer import metrics
 from kg_summarizer.trapi import GraphContainer
-from kg_summarizer.ai import generate_response
+from kg_summarizer.ai import agenerate_response, ageneral_summarize_abstracts, abstract_summary_prompt, asummarize_abstract_batch
+from kg_summarizer.trapi_async import ASYNC_QUERIES, AsyncQueryError, submit_async_query, resolve_async_query, forget_async_query
 
 class LLMParameters(BaseModel):
     gpt_model: str
     temperature: Optional[float] = 0.0
+    # None caches temperature 0 completions, False bypasses the completion cache
+    use_cache: Optional[bool] = None
 
 class TrapiParameters(BaseModel):
     result_idx: Optional[int] = 0
@@ -22,10 +35,23 @@ class AbstractItem(BaseModel):
     abstract: str
     parameters: Parameters
 
+class PubmedAbstract(BaseModel):
+    pmid: str
+    abstract: str
+
+class AbstractBatchItem(BaseModel):
+    abstracts: List[PubmedAbstract]
+    parameters: Parameters
+
 class ResponseItem(BaseModel):
     response: PDResponse
     parameters: Parameters
 
+class QueryItem(BaseModel):
+    query_graph: dict
+    target: Optional[str] = 'aragorn'
+    poll: Optional[bool] = None
+
 
 KG_SUM_VERSION = '0.1'
 
@@ -35,27 +61,172 @@ app = FastAPI(
     version=KG_SUM_VERSION
 )
 
+def endpoint_label(request):
+    # Route path template (e.g. /query/async/{job_id}) so job ids don't explode the label set
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return 'unmatched'
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    endpoint = endpoint_label(request)
+    in_flight = metrics.REQUESTS_IN_FLIGHT.labels(endpoint)
+    in_flight.inc()
+    start_time = perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.REQUEST_LATENCY.labels(endpoint, request.method).observe(perf_counter() - start_time)
+        metrics.REQUESTS.labels(endpoint, request.method, str(status)).inc()
+        in_flight.dec()
+
+@app.get("/metrics")
+async def metrics_handler():
+    body, content_type = metrics.render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.post("/summarize/abstract")
 async def summarize_abstract_handler(item: AbstractItem):
-    system_prompt = f"""
-    You are a pharmacology researcher summarizing publication abstracts. Condense the follow abstract to a single sentence.
-    """
+    try:
+        summary = await agenerate_response(
+            abstract_summary_prompt(), 
+            item.abstract, 
+            item.parameters.llm.gpt_model,
+            item.parameters.llm.temperature,
+            use_cache=item.parameters.llm.use_cache,
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail='OpenAI request timed out')
+    except openai.error.RateLimitError as e:
+        raise HTTPException(status_code=429, detail=f'OpenAI rate limit: {e}')
+    except openai.error.OpenAIError as e:
+        raise HTTPException(status_code=502, detail=f'OpenAI request failed: {e}')
+    return summary
 
-    summary = generate_response(
-        system_prompt, 
-        item.abstract, 
-        item.parameters.llm.gpt_model,
-        item.parameters.llm.temperature,
+@app.post("/summarize/abstracts")
+async def summarize_abstracts_handler(item: AbstractBatchItem):
+    """
+    Condenses many abstracts at once, returns {pmid: {"summary": ...}} or {pmid: {"error": ...}}.
+    """
+    llm_parameters = item.parameters.llm or LLMParameters(gpt_model='gpt-3.5-turbo')
+    return await asummarize_abstract_batch(
+        {abstract.pmid: abstract.abstract for abstract in item.abstracts},
+        model=llm_parameters.gpt_model,
+        temperature=llm_parameters.temperature,
+        use_cache=llm_parameters.use_cache,
     )
-    return summary
 
 @app.post("/summarize/edges")
-async def summarize_edges_handler(item: ResponseItem):
+async def summarize_edges_handler(item: ResponseItem, stream_format: str = 'ndjson', debug: bool = False):
+    """
+    Streams one JSON object per edge (and per support graph edge of creative results) as
+    soon as its summary is done, as NDJSON lines or server-sent events (stream_format=sse).
+    With debug=true the container construction profile is sent in a Server-Timing header.
+    """
+    if stream_format not in ('ndjson', 'sse'):
+        raise HTTPException(status_code=400, detail=f"Unknown stream_format '{stream_format}'")
 
-    g = GraphContainer(
-        item.response, 
-        verbose=False, 
-        result_idx=item.parameters.trapi.result_idx
-    )
+    trapi_parameters = item.parameters.trapi or TrapiParameters()
+    llm_parameters = item.parameters.llm or LLMParameters(gpt_model='gpt-3.5-turbo-16k')
+
+    def build_container():
+        g = GraphContainer(
+            json.loads(item.response.json(by_alias=True, exclude_none=True)),
+            verbose=False,
+            result_idx=trapi_parameters.result_idx,
+        )
+        # Fetch the abstracts of every edge in one batch before summarizing
+        g.prefetch(nodes=[])
+        return g
+
+    # Container construction does blocking network calls, keep it off the event loop
+    g = await asyncio.to_thread(build_container)
+
+    async def summarize_edge(edge, statement, support_graph=None):
+        edge_summary = dict(
+            subject=edge['subject'],
+            predicate=edge['predicate'],
+            object=edge['object'],
+            support_graph=support_graph,
+            n_publications=len(edge['publications']),
+            summary=None,
+            evidence=None,
+        )
+        if edge['publications']:
+            try:
+                edge_summary['summary'], edge_summary['evidence'] = await ageneral_summarize_abstracts(
+                    edge, statement, model=llm_parameters.gpt_model, temperature=llm_parameters.temperature,
+                    use_cache=llm_parameters.use_cache,
+                )
+            except asyncio.TimeoutError:
+                edge_summary['error'] = 'OpenAI request timed out'
+            except openai.error.OpenAIError as e:
+                edge_summary['error'] = str(e)
+            except Exception as e:
+                # Anything else would end the stream (already sent with a 200) for every edge
+                logging.exception(f"Failed to summarize '{statement}'")
+                edge_summary['error'] = f'{type(e).__name__}: {e}'
+        return edge_summary
+
+    async def stream_summaries():
+        jobs = []
+        for edge in g.edges:
+            statement = f"{edge['subject']} {edge['predicate']} {edge['object']}"
+            jobs.append((edge, statement, None))
+            for sentence, sg_edge_list in edge.get('support_graphs', {}).items():
+                jobs.extend((sg_edge, sentence, sentence) for sg_edge in sg_edge_list)
+
+        tasks = [asyncio.create_task(summarize_edge(*job)) for job in jobs]
+        try:
+            for task in asyncio.as_completed(tasks):
+                edge_summary = json.dumps(await task)
+                yield f"data: {edge_summary}\n\n" if stream_format == 'sse' else f"{edge_summary}\n"
+        finally:
+            # Client went away or a summary failed
+            for task in tasks:
+                task.cancel()
+
+    media_type = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    headers = {'Server-Timing': g.profile.server_timing()} if debug else None
+    return StreamingResponse(stream_summaries(), media_type=media_type, headers=headers)
+
+@app.post("/query/async")
+async def submit_query_handler(item: QueryItem):
+    try:
+        query = await submit_async_query(item.query_graph, target=item.target, poll=item.poll)
+    except AsyncQueryError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except aiohttp.ClientError as e:
+        raise HTTPException(status_code=502, detail=f"Target '{item.target}' request failed: {e}")
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Target '{item.target}' timed out")
+    return {'job_id': query.job_id, 'status': query.status}
+
+@app.get("/query/async/{job_id}")
+async def query_status_handler(job_id: str):
+    query = ASYNC_QUERIES.get(job_id)
+    if query is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job_id '{job_id}'")
+
+    status = query.status
+    if status == 'Running':
+        return {'job_id': job_id, 'status': status}
+
+    forget_async_query(job_id)
+    if status == 'Failed':
+        return {'job_id': job_id, 'status': status, 'description': str(query.future.exception())}
+    return {'job_id': job_id, 'status': status, 'response': query.future.result()}
 
-    return 999
+@app.post("/trapi/callback/{job_id}")
+async def trapi_callback_handler(job_id: str, request: Request):
+    # Raw JSON instead of a pydantic model, validating a large TRAPI response is slow
+    if not resolve_async_query(job_id, await request.json()):
+        raise HTTPException(status_code=404, detail=f"Unknown or finished job_id '{job_id}'")
+    return {'job_id': job_id, 'status': 'Completed'}
@@ -0,0 +1,135 @@
+from dataclasses import dataclass
+from functools import lru_cache
+
+import tiktoken
+
+# https://openai.com/pricing
+# https://platform.openai.com/docs/models/gpt-3-5
+OPENAI_MODEL_LIMITS = {
+    'gpt-3.5-turbo': {
+        'max_tokens': 4096,
+        'input_price_per_1k_tokens': 0.0015,
+        'output_price_per_1k_tokens': 0.002,
+    },
+    'gpt-3.5-turbo-16k': {
+        'max_tokens': 16384,
+        'input_price_per_1k_tokens': 0.003,
+        'output_price_per_1k_tokens': 0.004,
+    },
+    'gpt-4': {
+        'max_tokens': 8192,
+        'input_price_per_1k_tokens': 0.03,
+        'output_price_per_1k_tokens': 0.06,
+    },
+    'gpt-4-32k': {
+        'max_tokens': 32768,
+        'input_price_per_1k_tokens': 0.06,
+        'output_price_per_1k_tokens': 0.12,
+    },
+}
+
+
+# Unknown models (newer models, fine-tunes of unknown bases) get the smallest context size
+DEFAULT_MODEL_LIMITS = OPENAI_MODEL_LIMITS['gpt-3.5-turbo']
+DEFAULT_ENCODING = 'cl100k_base'
+
+
+def model_limits(model_name):
+    """
+    OPENAI_MODEL_LIMITS entry of the model, or of its base model for dated versions
+    ('gpt-4-0613') and fine-tunes ('ft:gpt-3.5-turbo-0613:org::id'), else DEFAULT_MODEL_LIMITS.
+    """
+    if model_name in OPENAI_MODEL_LIMITS:
+        return OPENAI_MODEL_LIMITS[model_name]
+    base_name = model_name[len('ft:'):] if model_name.startswith('ft:') else model_name
+    base_name = base_name.split(':')[0]
+    base_models = [name for name in OPENAI_MODEL_LIMITS if (base_name == name) or base_name.startswith(f'{name}-')]
+    return OPENAI_MODEL_LIMITS[max(base_models, key=len)] if base_models else DEFAULT_MODEL_LIMITS
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name):
+    # Loading an encoding reads (and on first use downloads) its BPE ranks, do it once per model
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        # Models tiktoken doesn't map (fine-tunes, models newer than the pinned tiktoken)
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+def count_tokens(strings, model_name, num_threads=8):
+    """
+    Token count of every string, encoded as one batch.
+    """
+    encoding = get_encoding(model_name)
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(list(strings), num_threads=num_threads)]
+
+def token_cost(prompt_tokens, completion_tokens, model_name):
+    """
+    Dollar cost of the input and output tokens at the prices of model_limits(model_name).
+    """
+    prices = model_limits(model_name)
+    input_cost = prompt_tokens / 1000 * prices.get('input_price_per_1k_tokens', 0)
+    output_cost = completion_tokens / 1000 * prices.get('output_price_per_1k_tokens', 0)
+    return input_cost, output_cost
+
+
+@dataclass
+class TokenEstimate:
+    model_name: str
+    counts: list
+    total: int
+    max_tokens: int
+    input_cost: float
+    output_cost: float
+
+    @property
+    def cost(self):
+        return self.input_cost + self.output_cost
+
+    @property
+    def exceeds_limit(self):
+        return (self.max_tokens is not None) and (self.total > self.max_tokens)
+
+def estimate_tokens(strings, model_name, completion_tokens=0):
+    """
+    Counts the tokens of a batch of strings (e.g. abstracts) and estimates the cost of sending
+    them as input, plus `completion_tokens` of output per string.
+    """
+    counts = count_tokens(strings, model_name)
+    total = sum(counts)
+    input_cost, output_cost = token_cost(total, completion_tokens * len(counts), model_name)
+
+    return TokenEstimate(
+        model_name=model_name,
+        counts=counts,
+        total=total,
+        max_tokens=model_limits(model_name)['max_tokens'],
+        input_cost=input_cost,
+        output_cost=output_cost,
+    )
+
+def prompt_token_budget(model_name, system_prompt, completion_tokens, message_overhead=16):
+    """
+    Tokens left for the user prompt after the system prompt, chat message framing and the
+    completion.
+    """
+    return model_limits(model_name)['max_tokens'] - count_tokens([system_prompt], model_name)[0] - completion_tokens - message_overhead
+
+def pack_token_budget(counts, budget, item_overhead=0, max_items=None):
+    """
+    Greedily groups consecutive items into batches (lists of indices) whose token counts sum to
+    at most `budget`, with at most `max_items` items each. An item larger than the budget gets a
+    batch of its own.
+    """
+    batches = []
+    batch, batch_tokens = [], 0
+    for idx, n_tokens in enumerate(counts):
+        n_tokens += item_overhead
+        over_budget = (budget is not None) and (batch_tokens + n_tokens > budget)
+        if batch and (over_budget or len(batch) == max_items):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(idx)
+        batch_tokens += n_tokens
+    if batch:
+        batches.append(batch)
+    return batches
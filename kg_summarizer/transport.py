@@ -0,0 +1,95 @@
+# Shared HTTP client for the TRAPI, node normalizer and PubMed calls. One client per
+# process keeps per-host keep-alive connection pools and is safe to use from any thread.
+# HTTP2=true switches to httpx (needs httpx[http2]), errors are requests exceptions either way.
+import threading
+from contextlib import contextmanager
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import kg_summarizer.config as CFG
+
+DEFAULT_TIMEOUT = (CFG.HTTP_CONNECT_TIMEOUT, CFG.HTTP_READ_TIMEOUT)
+
+client = None
+client_lock = threading.Lock()
+
+
+def get_client():
+    global client
+    if client is None:
+        with client_lock:
+            if client is None:
+                client = HttpxClient() if CFG.HTTP2 else RequestsClient()
+    return client
+
+
+class RequestsClient:
+    def __init__(self, pool_connections=CFG.HTTP_POOL_CONNECTIONS, pool_maxsize=CFG.HTTP_POOL_MAXSIZE):
+        self.session = requests.Session()
+        # Cookies are the only mutable session state, none of our upstreams need them
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, timeout=DEFAULT_TIMEOUT, **kwargs):
+        return self.session.request(method, url, timeout=timeout, **kwargs)
+
+    @contextmanager
+    def stream(self, method, url, timeout=DEFAULT_TIMEOUT, chunk_size=1 << 16, **kwargs):
+        with self.session.request(method, url, timeout=timeout, stream=True, **kwargs) as response:
+            yield response.status_code, response.iter_content(chunk_size), response.headers
+
+
+class HttpxClient:
+    def __init__(self, pool_connections=CFG.HTTP_POOL_CONNECTIONS, pool_maxsize=CFG.HTTP_POOL_MAXSIZE):
+        import httpx
+
+        self.httpx = httpx
+        limits = httpx.Limits(
+            max_connections=pool_connections * pool_maxsize,
+            max_keepalive_connections=pool_connections * pool_maxsize,
+        )
+        self.client = httpx.Client(http2=True, limits=limits)
+
+    def timeout(self, timeout):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return self.httpx.Timeout(read, connect=connect)
+        return self.httpx.Timeout(timeout)
+
+    @contextmanager
+    def raise_as_requests_errors(self):
+        try:
+            yield
+        except self.httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(str(e))
+        except self.httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e))
+
+    def request(self, method, url, timeout=DEFAULT_TIMEOUT, **kwargs):
+        with self.raise_as_requests_errors():
+            return self.client.request(method, url, timeout=self.timeout(timeout), **kwargs)
+
+    @contextmanager
+    def stream(self, method, url, timeout=DEFAULT_TIMEOUT, chunk_size=1 << 16, **kwargs):
+        with self.raise_as_requests_errors():
+            with self.client.stream(method, url, timeout=self.timeout(timeout), **kwargs) as response:
+                yield response.status_code, response.iter_bytes(chunk_size), response.headers
+
+
+def get(url, **kwargs):
+    return get_client().request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return get_client().request('POST', url, **kwargs)
+
+
+def stream(method, url, **kwargs):
+    """
+    Context manager yielding (status_code, iterator over body chunks, response headers).
+    """
+    return get_client().stream(method, url, **kwargs)
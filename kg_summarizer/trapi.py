@@ -1,51 +1,93 @@
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, wait
 from dataclasses import dataclass, field
 
 import json
-import requests
-import pathlib
+import logging
+import tempfile
+from hashlib import sha256
 from time import time
 
-from kg_summarizer.utils import normalize_list, cached_get_pubmed_abstract, unique_name_from_str
-
-def cache_query_knowledge_graph(query_graph, target='aragorn'): 
-    file_str = str(query_graph) + target
-    filename = f"{unique_name_from_str(file_str)}.json"
-
-    cache_dir = pathlib.Path('./query_cache')
-    cache_dir.mkdir(parents=True, exist_ok=True)
+import kg_summarizer.config as CFG
+import kg_summarizer.transport as transport
+from kg_summarizer.cache import SqliteCache
+from kg_summarizer.metrics import track_upstream
+from kg_summarizer.profiling import Profile, activate, current_profile, profiled, span
+from kg_summarizer.kg_index import KnowledgeGraphIndex
+from kg_summarizer.ranking import RankedResults
+from kg_summarizer.trapi_stream import load_trapi_subgraph
+from kg_summarizer.utils import (
+    normalize_list,
+    cached_get_pubmed_abstracts,
+    async_cached_get_pubmed_abstracts,
+    run_coroutine,
+)
+
+QUERY_CACHE = SqliteCache(
+    CFG.CACHE_DIR / 'query_cache.sqlite',
+    ttl=CFG.QUERY_CACHE_TTL,
+    max_bytes=CFG.QUERY_CACHE_MAX_BYTES,
+    compress=True,
+    # Few, large entries: keep max_bytes tight, eviction only reads the covering index
+    evict_every=1,
+)
+
+RESULT_TABLE_COLUMNS = (
+    'result_rank', 'score', 'edge_id', 'subject', 'subject_name', 'predicate', 'object', 'object_name',
+    'n_publications', 'support_graph',
+)
+
+def query_cache_key(query_graph, target='aragorn', **query_kwargs):
+    # Sorted keys so the same query graph always maps to the same entry
+    canonical_query = json.dumps(
+        dict(query_graph=query_graph, target=target, **query_kwargs), sort_keys=True, separators=(',', ':')
+    )
+    return sha256(canonical_query.encode('utf-8')).hexdigest()
+
+def cache_query_knowledge_graph(query_graph, target='aragorn', top_k=None, **query_kwargs):
+    """
+    With top_k set the response is streamed to and from the cache and only the top_k
+    results and the parts of the knowledge graph they reference are loaded.
+    """
+    key = query_cache_key(query_graph, target=target, **query_kwargs)
+
+    if top_k is not None:
+        trapi_file = QUERY_CACHE.open_file(key)
+        if trapi_file is not None:
+            print('Loading from cache...')
+        else:
+            trapi_file = spool_query_knowledge_graph(query_graph, target=target, **query_kwargs)
+            QUERY_CACHE.set_file(key, trapi_file)
+        with trapi_file:
+            return load_trapi_subgraph(trapi_file, top_k=top_k)
 
-    cached_queries = [s.name for s in cache_dir.glob('*.json')]
-    if filename in cached_queries:
+    rjson = QUERY_CACHE.get(key)
+    if rjson is not None:
         print('Loading from cache...')
-        with open(cache_dir/filename, 'r') as openfile:
-            rjson = json.load(openfile)
     else:
-        [response, response_time] = query_knowledge_graph(query_graph, target=target)
-        rjson = response.json()
-
-        with open(cache_dir/filename, 'w') as outfile:
-            json.dump(rjson, outfile)
+        rjson = query_knowledge_graph(query_graph, target=target, **query_kwargs)
+        QUERY_CACHE.set(key, rjson)
 
     return rjson
 
-def query_knowledge_graph(query_graph, answer_coalesce=False, async_query=False, target='aragorn'):
-    start_time = time()
-
+def get_trapi_request(query_graph, answer_coalesce=False, async_query=False, target='aragorn'):
     if target == 'aragorn':
         print('Querying Aragorn...')
         url = (
-            'https://aragorn.renci.org/aragorn/{qtype}'
-            # 'https://aragorn.renci.org/aragorn/{qtype}?answer_coalesce_type={actype}'
+            '{base}/aragorn/{qtype}'
+            # '{base}/aragorn/{qtype}?answer_coalesce_type={actype}'
         ).format(
+            base = CFG.ARAGORN_BASE_URL,
             qtype = 'asyncquery' if async_query else 'query',
             # actype = 'all' if answer_coalesce else 'none',
         )
-        callback = 'https://aragorn.renci.org/1.2/aragorn_callback' if async_query else ''
+        callback = f'{CFG.ARAGORN_BASE_URL}/1.2/aragorn_callback' if async_query else ''
     elif target == 'robokop':
         print('Querying Robokop...')
         url = (
-            'https://aragorn.renci.org/robokop/{qtype}?answer_coalesce_type={actype}'
+            '{base}/robokop/{qtype}?answer_coalesce_type={actype}'
         ).format(
+            base = CFG.ARAGORN_BASE_URL,
             qtype = 'asyncquery' if async_query else 'query',
             actype = 'all' if answer_coalesce else 'none',
         )
@@ -54,7 +96,7 @@ def query_knowledge_graph(query_graph, answer_coalesce=False, async_query=False,
         callback = ''
     elif target == 'strider':
         print('Querying Strider...')
-        url = 'https://strider.renci.org/1.4/query/'
+        url = CFG.STRIDER_URL
         callback = ''
     else:
         raise ValueError(f"Target '{target}' not defined")
@@ -69,38 +111,126 @@ def query_knowledge_graph(query_graph, answer_coalesce=False, async_query=False,
         message = dict(query_graph = query_graph),
     )
 
-    r = requests.post(url, headers=headers, json=trapi_query)
+    return url, headers, trapi_query
+
+def query_knowledge_graph(query_graph, answer_coalesce=False, async_query=False, target='aragorn', timeout=None):
+    start_time = time()
+
+    url, headers, trapi_query = get_trapi_request(
+        query_graph, answer_coalesce=answer_coalesce, async_query=async_query, target=target
+    )
+
+    timeout = (CFG.HTTP_CONNECT_TIMEOUT, CFG.TRAPI_READ_TIMEOUT if timeout is None else timeout)
+    with track_upstream(target):
+        r = transport.post(url, headers=headers, json=trapi_query, timeout=timeout)
     finish_time =  time()
     runtime = round(finish_time-start_time,2)
+    logging.info(f"Target '{target}' answered in {runtime}s")
 
+    # ARAs report failures as a JSON error body (e.g. {"detail": ...}), not a TRAPI message
+    if not 200 <= r.status_code < 300:
+        raise ValueError(f"Target '{target}' sent", r.status_code)
     rjson = r.json()
+    if (not async_query) and (not isinstance(rjson, dict) or rjson.get('message') is None):
+        raise ValueError(f"Target '{target}' sent a response without a message")
     return rjson
 
+def query_knowledge_graphs(query_graph, targets=('aragorn', 'robokop', 'strider'), timeout=CFG.FANOUT_TIMEOUT, **query_kwargs):
+    """
+    Sends the query graph to all targets concurrently and merges the responses (see
+    merge_trapi_responses). Targets that fail or miss the `timeout` deadline are left out,
+    so the wall-clock time is that of the slowest target that answers in time.
+    """
+    executor = ThreadPoolExecutor(max_workers=len(targets))
+    futures = {
+        executor.submit(query_knowledge_graph, query_graph, target=target, timeout=timeout, **query_kwargs): target
+        for target in targets
+    }
+    done, not_done = wait(futures, timeout=timeout)
+    # Don't wait for targets that missed the deadline
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    responses = {}
+    for future, target in futures.items():
+        if future in not_done:
+            logging.warning(f"Target '{target}' missed the {timeout}s deadline")
+        elif future.exception() is not None:
+            logging.warning(f"Target '{target}' failed: {future.exception()}")
+        else:
+            responses[target] = future.result()
+
+    if not responses:
+        raise ValueError(f"None of the targets {list(targets)} returned a response")
+
+    return merge_trapi_responses(responses)
+
+def spool_query_knowledge_graph(query_graph, answer_coalesce=False, async_query=False, target='aragorn'):
+    """
+    Like query_knowledge_graph but writes the raw response body to a temporary file
+    (returned at position 0) instead of parsing it, see trapi_stream.load_trapi_subgraph.
+    """
+    url, headers, trapi_query = get_trapi_request(
+        query_graph, answer_coalesce=answer_coalesce, async_query=async_query, target=target
+    )
+
+    trapi_file = tempfile.TemporaryFile()
+    with track_upstream(target), transport.stream(
+        'POST', url, headers=headers, json=trapi_query, timeout=(CFG.HTTP_CONNECT_TIMEOUT, CFG.TRAPI_READ_TIMEOUT)
+    ) as (status_code, body_chunks, _):
+        if status_code != 200:
+            raise ValueError(f"Target '{target}' sent", status_code)
+        for data in body_chunks:
+            trapi_file.write(data)
+
+    trapi_file.seek(0)
+    return trapi_file
+
 @dataclass
 class GraphContainer:
     response: dict
     verbose: bool = True
     result_idx: int = 0
+    rank_by: str = 'score' # analysis field results are ranked by
     graph_type: str = field(init=False) # lookup or creative
-    sorted_results: list = field(default_factory=list, init=False)
+    sorted_results: RankedResults = field(init=False)
     result: dict = field(default_factory=dict, init=False)
     nodes: dict = field(default_factory=dict, init=False)
     edges: list = field(default_factory=list, init=False)
+    node_norm: dict = field(default_factory=dict, init=False) # curie -> (identifier, label) or None
+    index: KnowledgeGraphIndex = field(init=False)
+    profile: Profile = field(init=False, repr=False) # per-stage timings, see profiling.py
 
     def __post_init__(self):
-        # Check graph type from query graph
-        self.graph_type = 'creative' if 't_edge' in self.response['message']['query_graph']['edges'] else 'lookup'
+        # Record into the caller's profile if there is one (e.g. to include the query itself)
+        self.profile = current_profile.get() or Profile()
 
-        # Remove top layer of response dictionary (assumes the query worked)
-        self.response = self.response['message']
+        with activate(self.profile), span('container.init'):
+            # Check graph type from query graph
+            self.graph_type = 'creative' if 't_edge' in self.response['message']['query_graph']['edges'] else 'lookup'
 
-        # Sort results by score
-        self.sorted_results = sorted(
-            self.response['results'], key=lambda d: d['analyses'][0]['score'], reverse=True
-        )
+            # Remove top layer of response dictionary (assumes the query worked)
+            self.response = self.response['message']
 
-        # Set current result as top result
-        self.set_result(self.result_idx)
+            # Attribute, adjacency, support graph and publication indexes over the knowledge graph
+            with span('container.index') as attributes:
+                self.index = KnowledgeGraphIndex(self.response)
+                attributes['items'] = len(self.response['knowledge_graph']['edges'])
+
+            # Rank results by score, only as deep as result_idx (or a later set_result) needs
+            with span('container.rank') as attributes:
+                self.sorted_results = RankedResults(
+                    self.response['results'], rank_by=self.rank_by, k=max(10, self.result_idx + 1)
+                )
+                attributes['items'] = len(self.response['results'])
+
+            # Normalize every curie the results can reference in a few batched calls
+            with span('container.collect_curies') as attributes:
+                curies = self.collect_curies()
+                attributes['items'] = len(curies)
+            self.normalize_curies(curies)
+
+            # Set current result as top result
+            self.set_result(self.result_idx)
 
     def set_result(self, idx):
         self.result_idx = idx
@@ -113,8 +243,89 @@ class GraphContainer:
         if self.verbose:
             print(msg)
 
+    def collect_curies(self):
+        kg = self.response['knowledge_graph']
+        aux_graphs = self.response.get('auxiliary_graphs') or {}
+
+        node_ids = set()
+        edge_ids = set()
+        for result in self.response['results']:
+            for id_list in result['node_bindings'].values():
+                for id_dict in id_list:
+                    node_ids.add(id_dict['id'])
+                    if id_dict.get('qnode_id') is not None:
+                        node_ids.add(id_dict['qnode_id'])
+
+            for analysis in result['analyses']:
+                for id_list in analysis['edge_bindings'].values():
+                    edge_ids.update(d['id'] for d in id_list)
+                for sgid in analysis.get('support_graphs') or []:
+                    edge_ids.update(aux_graphs.get(sgid, {}).get('edges', []))
+
+        # Edges of support graphs attached to bound (inferred) edges
+        for eid in list(edge_ids):
+            for sgid in self.index.edge_values(eid, 'biolink:support_graphs'):
+                edge_ids.update(aux_graphs.get(sgid, {}).get('edges', []))
+
+        curies = set(node_ids)
+        for eid in edge_ids:
+            edge = kg['edges'].get(eid)
+            if edge is not None:
+                curies.update([edge['subject'], edge['object']])
+
+        for nid in node_ids:
+            curies.update(self.index.node_values(nid, 'biolink:same_as'))
+
+        return curies
+
+    def normalize_curies(self, curies):
+        """
+        Same output as utils.normalize_list but served from the container's curie map,
+        only curies that have not been seen yet are sent to the node normalizer.
+        """
+        curies = list(dict.fromkeys(curies))
+        missing_curies = [c for c in curies if c not in self.node_norm]
+        if missing_curies:
+            with span('container.normalize', items=len(missing_curies)):
+                norm_dict = normalize_list(missing_curies)
+            for curie in missing_curies:
+                self.node_norm[curie] = norm_dict.get(curie)
+
+        return {c: self.node_norm[c] for c in curies if self.node_norm[c] is not None}
+
+    def format_spo(self, edge):
+        return format_spo(edge, self.normalize_curies([edge['subject'], edge['object']]))
+
+    @profiled('container.prefetch')
+    def prefetch(self, edges=None, nodes=None):
+        """
+        Fetches the publications of the given edges (default: all edges of the current
+        result, including support graph edges) and nodes (default: all nodes) concurrently
+        in one batch, instead of one edge or node at a time on first access.
+        """
+        edges = self.edges if edges is None else edges
+        nodes = self.nodes.values() if nodes is None else nodes
+
+        pubs_list = []
+        for edge in edges:
+            pubs_list.append(edge['publications'])
+            for sg_edge_list in edge.get('support_graphs', {}).values():
+                pubs_list.extend(sg_edge['publications'] for sg_edge in sg_edge_list)
+        for node in nodes:
+            pubs_list.append(node['publications'])
+            pubs_list.extend(qnode['publications'] for qnode in node.get('subclass_of', {}).values())
+
+        pubs_list = [pubs for pubs in pubs_list if isinstance(pubs, Publications) and not pubs.fetched]
+        pmids = {pmid for pubs in pubs_list for pmid in pubs.pub_ids}
+        if pmids:
+            with span('container.fetch_publications', items=len(pmids)):
+                abstracts = run_coroutine(async_cached_get_pubmed_abstracts(pmids))
+            for pubs in pubs_list:
+                pubs.set_abstracts(abstracts)
+
+    @profiled('container.node_info')
     def get_node_info(self):
-        def parse_node_attributes(attr_list_of_dicts, node_norm_name):
+        def parse_node_attributes(nid, node_norm_name):
             node_attr_data = {
                 'description': '',
                 'publications': [],
@@ -122,75 +333,61 @@ class GraphContainer:
                 'smiles': '',
             }
 
-            for attr_dict in attr_list_of_dicts:
-                atid = attr_dict['attribute_type_id']
-
-                if atid == 'biolink:same_as':
-                    same_as_norm_names = normalize_list(attr_dict['value'])
-                    node_attr_data['same_as'].extend([n[1] for n in same_as_norm_names.values() if n[1] != node_norm_name])
+            same_as_norm_names = self.normalize_curies(self.index.node_values(nid, 'biolink:same_as'))
+            node_attr_data['same_as'].extend([n[1] for n in same_as_norm_names.values() if n[1] != node_norm_name])
+            node_attr_data['same_as'].extend(self.index.node_values(nid, 'biolink:synonym'))
 
-                if atid == 'biolink:synonym':
-                    node_attr_data['same_as'].extend(attr_dict['value'])
-
-                if (atid == 'biolink:id') and (attr_dict.get('original_attribute_name') == 'standardized_smiles'):
+            for attr_dict in self.index.node_attributes(nid, 'biolink:id'):
+                if attr_dict.get('original_attribute_name') == 'standardized_smiles':
                     node_attr_data['smiles'] = attr_dict['value']
 
-                if atid in ['biolink:description', 'dct:description']:
+            for atid in ['biolink:description', 'dct:description']:
+                for attr_dict in self.index.node_attributes(nid, atid):
                     node_attr_data['description'] = attr_dict['value']
 
-                if atid == 'biolink:publications': 
-                    # Sometimes there are multiple publication attributes so extend list then fetch non-duplicates at the end
-                    publication_ids = attr_dict['value']
-                    node_attr_data['publications'].extend(publication_ids)
+            # Sometimes there are multiple publication attributes so extend list then fetch non-duplicates at the end
+            node_attr_data['publications'].extend(self.index.node_values(nid, 'biolink:publications'))
 
             # Remove duplicates
             node_attr_data['publications'] = list(set(node_attr_data['publications']))
             node_attr_data['same_as'] = list(set(node_attr_data['same_as']))
 
-            # Fetch publications
-            node_attr_data['publications'] = get_publications(node_attr_data['publications'])
+            # Publications are fetched on first access (or with prefetch)
+            node_attr_data['publications'] = Publications(node_attr_data['publications'])
 
             return node_attr_data
 
         for qnode_name, id_list in self.result['node_bindings'].items():
             for id_dict in id_list: 
                 curie = id_dict.get('id')
-                node_norm_name = normalize_list([curie])[curie][1]
-
-                node_info = self.response['knowledge_graph']['nodes'][curie]
+                node_norm_name = self.normalize_curies([curie])[curie][1]
 
-                self.nodes[node_norm_name] = parse_node_attributes(node_info['attributes'], node_norm_name)
+                self.nodes[node_norm_name] = parse_node_attributes(curie, node_norm_name)
 
                 qcurie = id_dict.get('qnode_id')
                 if qcurie is not None:
-                    qnode_norm_name = normalize_list([curie])[curie][1]
-                    qnode_info = self.response['knowledge_graph']['nodes'][qcurie]
+                    qnode_norm_name = self.normalize_curies([qcurie])[qcurie][1]
                     self.nodes[node_norm_name]['subclass_of'] = {
-                        qnode_norm_name: parse_node_attributes(qnode_info['attributes'], qnode_norm_name),
+                        qnode_norm_name: parse_node_attributes(qcurie, qnode_norm_name),
                     }
 
+    @profiled('container.edge_info')
     def get_edge_info(self, fetch_pubs=True):
-        def parse_edge_attributes(attr_list_of_dicts, fetch_pubs=True):
+        def parse_edge_attributes(eid, fetch_pubs=True):
             edge_attr_data = {
-                'publications': [],
+                # Sometimes there are multiple publication attributes so extend list then fetch non-duplicates at the end
+                'publications': list(self.index.edge_values(eid, 'biolink:publications')),
             }
 
-            for attr_dict in attr_list_of_dicts:
-                atid = attr_dict['attribute_type_id']
-
-                if atid == 'biolink:publications': 
-                    # Sometimes there are multiple publication attributes so extend list then fetch non-duplicates at the end
-                    publication_ids = attr_dict['value']
-                    edge_attr_data['publications'].extend(publication_ids)
-
-                if atid == 'biolink:support_graphs':
-                    edge_attr_data['support_graphs'] = attr_dict['value']
+            support_graph_ids = self.index.edge_values(eid, 'biolink:support_graphs')
+            if support_graph_ids:
+                edge_attr_data['support_graphs'] = support_graph_ids
 
             # Remove duplicates
             edge_attr_data['publications'] = list(set(edge_attr_data['publications']))
 
             if fetch_pubs:
-                edge_attr_data['publications'] = get_publications(edge_attr_data['publications'])
+                edge_attr_data['publications'] = Publications(edge_attr_data['publications'])
 
             return edge_attr_data
 
@@ -198,39 +395,41 @@ class GraphContainer:
         edge_list = []
 
         if self.graph_type == 'creative':
-            for id_dict in self.result['analyses'][0]['edge_bindings']['t_edge']:
+            for id_dict in result_edge_bindings(self.result).get('t_edge', []):
                 eid = id_dict['id']
                 t_edge = self.response['knowledge_graph']['edges'][eid]
 
-                t_sub, t_pred, t_obj = format_spo(t_edge)
-                t_edge_attr_data = parse_edge_attributes(t_edge['attributes'], fetch_pubs=fetch_pubs)
+                t_sub, t_pred, t_obj = self.format_spo(t_edge)
+                t_edge_attr_data = parse_edge_attributes(eid, fetch_pubs=fetch_pubs)
 
                 support_graphs = {}
-                for sgid in t_edge_attr_data.pop('support_graphs', []):
-                    spo_path_sentence = ''
-                    sg_edge_list = self.response['auxiliary_graphs'][sgid]['edges']
-                    n_edges = len(sg_edge_list)
-                    sg_edge_info_list = []
-                    for seid_idx, seid in enumerate(sg_edge_list):
-                        edge = self.response['knowledge_graph']['edges'][seid]
-                        sub, pred, obj = format_spo(edge)
-                        edge_attr_data = parse_edge_attributes(edge['attributes'], fetch_pubs=fetch_pubs)
-
-                        sg_edge_info_list.append(dict(
-                            subject=sub,
-                            object=obj,
-                            predicate=pred,
-                            **edge_attr_data
-                        ))
-
-                        if n_edges == 1:
-                            spo_path_sentence += f"{sub} {pred} {obj}."
-                        elif seid_idx == n_edges - 1:
-                            spo_path_sentence += f"and {sub} {pred} {obj}."
-                        else:
-                            spo_path_sentence += f"{sub} {pred} {obj}, "
-
-                    support_graphs[spo_path_sentence] = sg_edge_info_list
+                with span('container.support_graphs') as attributes:
+                    attributes['items'] = len(t_edge_attr_data.get('support_graphs', []))
+                    for sgid in t_edge_attr_data.pop('support_graphs', []):
+                        spo_path_sentence = ''
+                        sg_edge_list = self.response['auxiliary_graphs'][sgid]['edges']
+                        n_edges = len(sg_edge_list)
+                        sg_edge_info_list = []
+                        for seid_idx, seid in enumerate(sg_edge_list):
+                            edge = self.response['knowledge_graph']['edges'][seid]
+                            sub, pred, obj = self.format_spo(edge)
+                            edge_attr_data = parse_edge_attributes(seid, fetch_pubs=fetch_pubs)
+
+                            sg_edge_info_list.append(dict(
+                                subject=sub,
+                                object=obj,
+                                predicate=pred,
+                                **edge_attr_data
+                            ))
+
+                            if n_edges == 1:
+                                spo_path_sentence += f"{sub} {pred} {obj}."
+                            elif seid_idx == n_edges - 1:
+                                spo_path_sentence += f"and {sub} {pred} {obj}."
+                            else:
+                                spo_path_sentence += f"{sub} {pred} {obj}, "
+
+                        support_graphs[spo_path_sentence] = sg_edge_info_list
 
                 edge_list.append(dict(
                     subject=t_sub,
@@ -243,12 +442,12 @@ class GraphContainer:
             self.edges = edge_list            
             
         else:
-            for eid, id_list in self.result['analyses'][0]['edge_bindings'].items():
+            for eid, id_list in result_edge_bindings(self.result).items():
                 id_list = [d['id'] for d in id_list]
                 for id in id_list:
                     edge = self.response['knowledge_graph']['edges'][id]
-                    sub, pred, obj = format_spo(edge)
-                    edge_attr_data = parse_edge_attributes(edge['attributes'], fetch_pubs=False)
+                    sub, pred, obj = self.format_spo(edge)
+                    edge_attr_data = parse_edge_attributes(id, fetch_pubs=False)
 
                     edge_list.append(dict(
                         subject=sub,
@@ -261,21 +460,86 @@ class GraphContainer:
 
             if fetch_pubs:
                 for edge in self.edges:
-                    edge['publications'] = get_publications(edge['publications'])
+                    edge['publications'] = Publications(edge['publications'])
+
+    def result_rows(self, top_n=None):
+        """
+        One row per knowledge graph edge of the top_n (default: all) ranked results, creative
+        results also get a row per support graph edge. Curies are normalized in one batch and
+        the current result is left as is.
+        """
+        kg_edges = self.response['knowledge_graph']['edges']
+        aux_graphs = self.response.get('auxiliary_graphs') or {}
+        n_results = len(self.sorted_results) if top_n is None else min(top_n, len(self.sorted_results))
+
+        with span('container.result_rows') as attributes:
+            # (rank, score, edge id, support graph id) for every edge first, then normalize once
+            bindings = []
+            for rank, result in enumerate(self.sorted_results[:n_results]):
+                score = self.sorted_results.key(result)
+                for id_list in result_edge_bindings(result).values():
+                    for id_dict in id_list:
+                        bindings.append((rank, score, id_dict['id'], None))
+                        for sgid in self.index.edge_values(id_dict['id'], 'biolink:support_graphs'):
+                            bindings.extend(
+                                (rank, score, seid, sgid) for seid in aux_graphs.get(sgid, {}).get('edges', [])
+                            )
+
+            curies = []
+            for _, _, eid, _ in bindings:
+                curies.extend([kg_edges[eid]['subject'], kg_edges[eid]['object']])
+            norm_dict = self.normalize_curies(curies)
+
+            rows = []
+            for rank, score, eid, sgid in bindings:
+                edge = kg_edges[eid]
+                sub, obj = edge['subject'], edge['object']
+                rows.append(dict(
+                    result_rank=rank,
+                    score=score,
+                    edge_id=eid,
+                    subject=sub,
+                    subject_name=norm_dict[sub][1] if sub in norm_dict else None,
+                    predicate=edge['predicate'],
+                    object=obj,
+                    object_name=norm_dict[obj][1] if obj in norm_dict else None,
+                    n_publications=len(set(self.index.edge_values(eid, 'biolink:publications'))),
+                    support_graph=sgid,
+                ))
+            attributes['items'] = len(rows)
+
+        return rows
+
+    def results_table(self, top_n=None, format='pandas'):
+        """
+        result_rows as a pandas DataFrame (format='pandas') or a pyarrow Table (format='arrow').
+        """
+        rows = self.result_rows(top_n)
+        if format == 'pandas':
+            import pandas as pd
+            return pd.DataFrame(rows, columns=RESULT_TABLE_COLUMNS)
+        if format == 'arrow':
+            import pyarrow as pa
+            return pa.Table.from_pydict({column: [row[column] for row in rows] for column in RESULT_TABLE_COLUMNS})
+        raise ValueError(f"Unknown results table format '{format}', expected 'pandas' or 'arrow'")
 
     def print_results(self, top_n=5):
-        for idx in range(top_n):
-            self.result = self.sorted_results[idx]
-            print(f"\nResult idx: {idx}")
-            try:
-                self.get_edge_info(fetch_pubs=False)
-            except Exception:
-                print('Failed to normalize')
-            else:
-                for edge in self.edges:
-                    print(f"{edge['subject']} {edge['predicate']} {edge['object']}")
+        rank = None
+        for row in self.result_rows(top_n):
+            if row['result_rank'] != rank:
+                rank = row['result_rank']
+                printed = set()
+                print(f"\nResult idx: {rank}")
+            if row['support_graph'] is not None:
+                continue
 
-        self.set_result(self.result_idx)
+            if (row['subject_name'] is None) or (row['object_name'] is None):
+                line = 'Failed to normalize'
+            else:
+                line = f"{row['subject_name']} {format_predicate(row['predicate'])} {row['object_name']}"
+            if line not in printed:
+                printed.add(line)
+                print(line)
 
     def print_node_info(self, nid, print_biolink_attrs=False):
         if type(nid) == int:
@@ -298,7 +562,7 @@ class GraphContainer:
             print('\n')
 
             if attr_dict['attribute_type_id'] == 'biolink:same_as':
-                print(normalize_list(attr_dict['value']))
+                print(self.normalize_curies(attr_dict['value']))
 
     def print_support_graphs(self, sg_list, print_full_edge=True):
         for sg in sg_list:
@@ -306,39 +570,39 @@ class GraphContainer:
             print()
             for eid in self.response['auxiliary_graphs'][sg]['edges']:
                 edge = self.response['knowledge_graph']['edges'][eid]
-                print_edge(edge, print_full_edge=print_full_edge)
+                print_edge(edge, print_full_edge=print_full_edge, node_norm=self.normalize_curies([edge['subject'], edge['object']]))
                 print()
             print('\n' + 100*'*' + '\n')
 
+    def print_profile(self):
+        print(self.profile.report())
+
     def print_edge_info(self):
         if self.graph_type == 'creative':
-            for id_dict in self.result['analyses'][0]['edge_bindings']['t_edge']:
+            for id_dict in result_edge_bindings(self.result).get('t_edge', []):
                 edge_binding = id_dict['id']
                 t_edge = self.response['knowledge_graph']['edges'][edge_binding]
 
-                print_edge(t_edge)
+                print_edge(t_edge, node_norm=self.normalize_curies([t_edge['subject'], t_edge['object']]))
 
-                for attr_dict in t_edge['attributes']:
-                    atid = attr_dict['attribute_type_id']
-
-                    if atid == 'biolink:support_graphs':
-                        t_edge_support_graphs = attr_dict['value']
-                        print(f"\n{125*'*'}\n* Support Graphs\n{125*'*'}")
-                        self.print_support_graphs(t_edge_support_graphs)
+                for attr_dict in self.index.edge_attributes(edge_binding, 'biolink:support_graphs'):
+                    t_edge_support_graphs = attr_dict['value']
+                    print(f"\n{125*'*'}\n* Support Graphs\n{125*'*'}")
+                    self.print_support_graphs(t_edge_support_graphs)
         else:
-            for eid, id_list in self.result['analyses'][0]['edge_bindings'].items():
+            for eid, id_list in result_edge_bindings(self.result).items():
                 id_list = [d['id'] for d in id_list]
                 for id in id_list:
                     edge = self.response['knowledge_graph']['edges'][id]
                     print(edge.keys())
 
-                    atid = [attribute['attribute_type_id'] for attribute in edge['attributes']]
+                    atid = list(self.index.edge_attrs[id])
                     print(atid)
                         
-                    print_edge(edge)
+                    print_edge(edge, node_norm=self.normalize_curies([edge['subject'], edge['object']]))
                     print()
 
-        cooccur_support_graphs = self.result['analyses'][0].get('support_graphs', [])
+        cooccur_support_graphs = result_support_graphs(self.result)
         print(f"\n{125*'*'}\n* Literature Co-Occurrence Support Graphs\n{125*'*'}")
         self.print_support_graphs(cooccur_support_graphs, print_full_edge=False)
 
@@ -354,28 +618,195 @@ def merge_dicts(lod):
     merged_list = list(merged_dict.values())
     return merged_list
 
-def format_spo(edge):
+def result_edge_bindings(result):
+    """
+    Edge bindings of every analysis of a result (e.g. one analysis per target after
+    merge_trapi_responses), edges deduplicated per query edge in order of first appearance.
+    """
+    bindings = {}
+    for analysis in result['analyses']:
+        for qedge_id, id_list in analysis['edge_bindings'].items():
+            qedge_bindings = bindings.setdefault(qedge_id, {})
+            for id_dict in id_list:
+                qedge_bindings.setdefault(id_dict['id'], id_dict)
+    return {qedge_id: list(qedge_bindings.values()) for qedge_id, qedge_bindings in bindings.items()}
+
+def result_support_graphs(result):
+    return list(dict.fromkeys(
+        sgid for analysis in result['analyses'] for sgid in analysis.get('support_graphs') or []
+    ))
+
+def merge_trapi_responses(responses):
+    """
+    Merges {target: TRAPI response} into one TRAPI response. Nodes are deduplicated by
+    curie and edges by their (subject, predicate, object) key, with their attributes and
+    sources unioned. Auxiliary graph ids are prefixed with the target. Results with the
+    same node bindings are merged into one result with the analyses of every target.
+    """
+    nodes = {}
+    edges = {}
+    edge_keys = {}
+    auxiliary_graphs = {}
+    results = {}
+    query_graph = None
+
+    for target, response in responses.items():
+        message = response['message']
+        kg = message.get('knowledge_graph') or {'nodes': {}, 'edges': {}}
+        if query_graph is None:
+            query_graph = message['query_graph']
+
+        for nid, node in kg['nodes'].items():
+            if nid in nodes:
+                merged_node = nodes[nid]
+                merged_node['categories'] = list(dict.fromkeys(merged_node.get('categories', []) + node.get('categories', [])))
+                merged_node['attributes'] = merge_attributes(merged_node.get('attributes'), node.get('attributes'))
+            else:
+                nodes[nid] = dict(node)
+
+        aux_graph_ids = {sgid: f"{target}:{sgid}" for sgid in (message.get('auxiliary_graphs') or {})}
+
+        edge_ids = {}
+        for eid, edge in kg['edges'].items():
+            edge = dict(edge)
+            edge['attributes'] = [
+                dict(attr_dict, value=[aux_graph_ids.get(sgid, sgid) for sgid in attr_dict['value']])
+                if attr_dict['attribute_type_id'] == 'biolink:support_graphs' else attr_dict
+                for attr_dict in edge.get('attributes') or []
+            ]
+
+            key = (edge['subject'], edge['predicate'], edge['object'])
+            if key in edge_keys:
+                merged_eid = edge_keys[key]
+                edges[merged_eid]['attributes'] = merge_attributes(edges[merged_eid]['attributes'], edge['attributes'])
+                edges[merged_eid]['sources'] = merge_sources(edges[merged_eid].get('sources'), edge.get('sources'))
+            else:
+                merged_eid = eid if eid not in edges else f"{target}:{eid}"
+                edge_keys[key] = merged_eid
+                edges[merged_eid] = edge
+            edge_ids[eid] = merged_eid
+
+        for sgid, aux_graph in (message.get('auxiliary_graphs') or {}).items():
+            auxiliary_graphs[aux_graph_ids[sgid]] = dict(
+                aux_graph, edges=[edge_ids.get(eid, eid) for eid in aux_graph['edges']]
+            )
+
+        for result in message.get('results') or []:
+            analyses = []
+            for analysis in result['analyses']:
+                analysis = dict(analysis)
+                analysis['edge_bindings'] = {
+                    qedge_id: [dict(id_dict, id=edge_ids.get(id_dict['id'], id_dict['id'])) for id_dict in id_list]
+                    for qedge_id, id_list in analysis['edge_bindings'].items()
+                }
+                if analysis.get('support_graphs'):
+                    analysis['support_graphs'] = [aux_graph_ids.get(sgid, sgid) for sgid in analysis['support_graphs']]
+                analyses.append(analysis)
+
+            key = tuple(sorted(
+                (qnode_id, id_dict['id']) for qnode_id, id_list in result['node_bindings'].items() for id_dict in id_list
+            ))
+            if key in results:
+                results[key]['analyses'].extend(analyses)
+            else:
+                results[key] = dict(result, analyses=analyses)
+
+    return dict(message=dict(
+        query_graph=query_graph,
+        knowledge_graph=dict(nodes=nodes, edges=edges),
+        auxiliary_graphs=auxiliary_graphs,
+        results=list(results.values()),
+    ))
+
+def merge_attributes(attr_list_a, attr_list_b):
+    merged = {}
+    for attr_dict in (attr_list_a or []) + (attr_list_b or []):
+        merged.setdefault(json.dumps(attr_dict, sort_keys=True), attr_dict)
+    return list(merged.values())
+
+def merge_sources(source_list_a, source_list_b):
+    # One entry per (resource_id, resource_role) with the upstream resources of both
+    merged = {}
+    for source in (source_list_a or []) + (source_list_b or []):
+        key = (source.get('resource_id'), source.get('resource_role'))
+        if key in merged:
+            upstream_ids = (merged[key].get('upstream_resource_ids') or []) + (source.get('upstream_resource_ids') or [])
+            if upstream_ids:
+                merged[key] = dict(merged[key], upstream_resource_ids=list(dict.fromkeys(upstream_ids)))
+        else:
+            merged[key] = source
+    return list(merged.values())
+
+def format_spo(edge, node_norm=None):
     sub, obj, pred = edge['subject'], edge['object'], edge['predicate']
-    ndict = normalize_list([sub, obj])
-    nlist = [n[1] for n in ndict.values()]
-    if len(nlist) != 2:
+    ndict = normalize_list([sub, obj]) if node_norm is None else node_norm
+    if (sub not in ndict) or (obj not in ndict):
         raise Exception(f"Failed to normalize nodes.\nIDs to normalize: {sub}, {obj}\nReturned normalization {ndict}")
-    sub, obj = nlist[0], nlist[1]
-    pred = pred.split(':')[1].replace('_', ' ')
-    return sub, pred, obj
+    sub, obj = ndict[sub][1], ndict[obj][1]
+    return sub, format_predicate(pred), obj
+
+def format_predicate(pred):
+    return pred.split(':')[1].replace('_', ' ')
 
-def print_edge(edge, print_full_edge=True):
-    sub, pred, obj = format_spo(edge)
+def print_edge(edge, print_full_edge=True, node_norm=None):
+    sub, pred, obj = format_spo(edge, node_norm=node_norm)
     print(f"{sub} {pred} {obj}")
     if print_full_edge:
         print(edge)
 
+class Publications(Sequence):
+    """
+    Lazy list of {pubid: abstract} dicts, the abstracts are fetched on first access.
+    """
+
+    def __init__(self, pub_id_list):
+        self.pub_ids = list(dict.fromkeys(pubid for pubid in pub_id_list if pubid.startswith('PMID:')))
+        self.pub_list = None
+
+    @property
+    def fetched(self):
+        return self.pub_list is not None
+
+    def fetch(self):
+        if self.pub_list is None:
+            self.pub_list = get_publications(self.pub_ids)
+        return self.pub_list
+
+    def set_abstracts(self, abstracts):
+        self.pub_list = [{pubid: abstracts[pubid]} for pubid in self.pub_ids if abstracts.get(pubid) is not None]
+
+    def __getitem__(self, idx):
+        return self.fetch()[idx]
+
+    def __len__(self):
+        return len(self.fetch())
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(self.fetch())
+
 def get_publications(pub_id_list):
+    pmid_list = [pubid for pubid in pub_id_list if pubid.startswith('PMID:')]
+    abstracts = cached_get_pubmed_abstracts(pmid_list)
+
+    pub_list = []
+    for pubid in pmid_list:
+        abstract = abstracts.get(pubid)
+        if abstract is not None:
+            pub_list.append({pubid: abstract})
+
+    return pub_list
+
+async def async_get_publications(pub_id_list):
+    pmid_list = [pubid for pubid in pub_id_list if pubid.startswith('PMID:')]
+    abstracts = await async_cached_get_pubmed_abstracts(pmid_list)
+
     pub_list = []
-    for pubid in pub_id_list:
-        if pubid.startswith('PMID:'):
-            abstract = cached_get_pubmed_abstract(pubid)
-            if abstract is not None:
-                pub_list.append({pubid: abstract})
+    for pubid in pmid_list:
+        abstract = abstracts.get(pubid)
+        if abstract is not None:
+            pub_list.append({pubid: abstract})
 
     return pub_list
\ No newline at end of file
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from time import time
+from uuid import uuid4
+
+import aiohttp
+
+import kg_summarizer.config as CFG
+from kg_summarizer.metrics import track_upstream
+from kg_summarizer.trapi import get_trapi_request
+
+# Queries submitted by this process, results have to come back to the same worker
+ASYNC_QUERIES = {}
+
+
+class AsyncQueryError(Exception):
+    """
+    The ARA rejected, failed or never finished an async query.
+    """
+
+
+@dataclass
+class AsyncQuery:
+    job_id: str
+    target: str
+    url: str
+    future: asyncio.Future
+    remote_job_id: str = None
+    created_at: float = field(default_factory=time)
+    poll_task: asyncio.Task = None
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return 'Running'
+        return 'Failed' if self.future.exception() is not None else 'Completed'
+
+
+async def submit_async_query(query_graph, target='aragorn', answer_coalesce=False, session=None, poll=None):
+    """
+    Submits a query to the target's /asyncquery endpoint and returns an AsyncQuery whose
+    future resolves with the TRAPI response. The response either arrives at the callback
+    endpoint (see resolve_async_query) or, with poll=True or no TRAPI_CALLBACK_BASE_URL,
+    by polling the ARA's asyncquery_status endpoint.
+    """
+    prune_async_queries()
+
+    url, headers, trapi_query = get_trapi_request(
+        query_graph, answer_coalesce=answer_coalesce, async_query=True, target=target
+    )
+    if 'asyncquery' not in url:
+        raise ValueError(f"Target '{target}' does not support async queries")
+
+    poll = (CFG.TRAPI_CALLBACK_BASE_URL is None) if poll is None else poll
+    job_id = uuid4().hex
+    if CFG.TRAPI_CALLBACK_BASE_URL is not None:
+        trapi_query['callback'] = f"{CFG.TRAPI_CALLBACK_BASE_URL.rstrip('/')}/trapi/callback/{job_id}"
+
+    # Registered before the submit since the callback can arrive before the submit returns
+    query = AsyncQuery(job_id, target, url, asyncio.get_running_loop().create_future())
+    ASYNC_QUERIES[job_id] = query
+
+    try:
+        async with session_context(session) as session:
+            with track_upstream(target):
+                async with session.post(url, headers=headers, json=trapi_query) as r:
+                    if r.status not in (200, 202):
+                        raise AsyncQueryError(f"Target '{target}' sent {r.status}")
+                    rjson = await r.json(content_type=None)
+        query.remote_job_id = rjson.get('job_id')
+
+        if poll and (query.remote_job_id is None):
+            raise AsyncQueryError(f"Target '{target}' did not return a job_id to poll")
+    except BaseException:
+        # Failed submits (including network errors and cancellation) must not stay registered
+        forget_async_query(job_id)
+        raise
+
+    if poll:
+        query.poll_task = asyncio.create_task(poll_async_query(query))
+
+    return query
+
+
+def resolve_async_query(job_id, response):
+    query = ASYNC_QUERIES.get(job_id)
+    if (query is None) or query.future.done():
+        return False
+    query.future.set_result(response)
+    return True
+
+
+async def wait_async_query(job_id, timeout=CFG.ASYNC_QUERY_TIMEOUT):
+    query = ASYNC_QUERIES[job_id]
+    try:
+        return await asyncio.wait_for(asyncio.shield(query.future), timeout)
+    finally:
+        if query.future.done():
+            forget_async_query(job_id)
+
+
+async def poll_async_query(query, interval=CFG.ASYNC_QUERY_POLL_INTERVAL, session=None, timeout=CFG.ASYNC_QUERY_TIMEOUT):
+    """
+    Polls the ARA until the query completes or fails. Unexpected status bodies and missing
+    the `timeout` deadline fail the query too, so it never stays Running.
+    """
+    try:
+        await asyncio.wait_for(poll_async_status(query, interval, session), timeout)
+    except asyncio.TimeoutError:
+        fail_async_query(query, AsyncQueryError(f"Async query {query.job_id} did not complete within {timeout}s"))
+    except Exception as e:
+        logging.exception(f"Polling async query {query.job_id} failed")
+        fail_async_query(query, AsyncQueryError(f"Polling async query {query.job_id} failed: {type(e).__name__}: {e}"))
+
+
+async def poll_async_status(query, interval, session=None):
+    status_url = query.url.replace('asyncquery', f"asyncquery_status/{query.remote_job_id}")
+    async with session_context(session) as session:
+        while not query.future.done():
+            await asyncio.sleep(interval)
+            try:
+                with track_upstream(query.target):
+                    async with session.get(status_url) as r:
+                        if r.status != 200:
+                            continue
+                        status = await r.json(content_type=None)
+
+                if status.get('status') == 'Failed':
+                    fail_async_query(query, AsyncQueryError(f"Async query {query.job_id} failed: {status.get('description')}"))
+                elif (status.get('status') == 'Completed') and status.get('response_url'):
+                    with track_upstream(query.target):
+                        async with session.get(status['response_url']) as r:
+                            if r.status != 200:
+                                continue
+                            response = await r.json(content_type=None)
+                    resolve_async_query(query.job_id, response)
+                elif (status.get('status') == 'Completed') and (CFG.TRAPI_CALLBACK_BASE_URL is None):
+                    # Without a callback the response can't arrive any other way
+                    fail_async_query(query, AsyncQueryError(f"Async query {query.job_id} completed without a response_url"))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"Polling async query {query.job_id} failed: {e}")
+
+
+def fail_async_query(query, error):
+    if not query.future.done():
+        query.future.set_exception(error)
+
+
+def forget_async_query(job_id):
+    query = ASYNC_QUERIES.pop(job_id, None)
+    if (query is not None) and (query.poll_task is not None):
+        query.poll_task.cancel()
+
+
+def prune_async_queries():
+    now = time()
+    for job_id, query in list(ASYNC_QUERIES.items()):
+        if now - query.created_at > CFG.ASYNC_QUERY_TIMEOUT:
+            forget_async_query(job_id)
+
+
+@asynccontextmanager
+async def session_context(session=None):
+    # Use the given aiohttp session, or open (and close) a new one
+    if session is not None:
+        yield session
+    else:
+        async with aiohttp.ClientSession() as session:
+            yield session
@@ -0,0 +1,88 @@
+import heapq
+
+import ijson
+
+from kg_summarizer.ranking import result_score
+
+
+def load_trapi_subgraph(trapi_file, top_k=10, rank_by='score'):
+    """
+    Builds a TRAPI response with only the top_k results (see ranking.result_score) and the
+    knowledge graph nodes/edges and auxiliary graphs they reference, without loading the
+    whole response. `trapi_file` is a seekable binary file that is parsed incrementally
+    in a few passes, so peak memory scales with the kept subgraph.
+    """
+    query_graph = next(iter(json_items(trapi_file, 'message.query_graph')), None)
+
+    # Keep the top_k results, the counter breaks ties so results are never compared
+    heap = []
+    for ridx, result in enumerate(json_items(trapi_file, 'message.results.item')):
+        entry = (result_score(result, rank_by=rank_by), -ridx, result)
+        if len(heap) < top_k:
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heappushpop(heap, entry)
+    results = [result for score, ridx, result in sorted(heap, reverse=True)]
+
+    node_ids = set()
+    edge_ids = set()
+    aux_graph_ids = set()
+    for result in results:
+        for id_list in result['node_bindings'].values():
+            for id_dict in id_list:
+                node_ids.add(id_dict['id'])
+                if id_dict.get('qnode_id') is not None:
+                    node_ids.add(id_dict['qnode_id'])
+        for analysis in result['analyses']:
+            for id_list in analysis['edge_bindings'].values():
+                edge_ids.update(d['id'] for d in id_list)
+            aux_graph_ids.update(analysis.get('support_graphs') or [])
+
+    # Support graphs reference edges which can reference more support graphs, so alternate
+    # edge and auxiliary graph passes until nothing new is referenced
+    edges = {}
+    auxiliary_graphs = {}
+    while (edge_ids - edges.keys()) or (aux_graph_ids - auxiliary_graphs.keys()):
+        new_edge_ids = edge_ids - edges.keys()
+        if new_edge_ids:
+            for eid, edge in json_kvitems(trapi_file, 'message.knowledge_graph.edges'):
+                if eid in new_edge_ids:
+                    edges[eid] = edge
+                    for attr_dict in edge.get('attributes') or []:
+                        if attr_dict['attribute_type_id'] == 'biolink:support_graphs':
+                            aux_graph_ids.update(attr_dict['value'])
+            # Drop ids that aren't in the knowledge graph so the loop terminates
+            edge_ids &= edges.keys()
+
+        new_aux_graph_ids = aux_graph_ids - auxiliary_graphs.keys()
+        if new_aux_graph_ids:
+            for sgid, aux_graph in json_kvitems(trapi_file, 'message.auxiliary_graphs'):
+                if sgid in new_aux_graph_ids:
+                    auxiliary_graphs[sgid] = aux_graph
+                    edge_ids.update(aux_graph['edges'])
+            aux_graph_ids &= auxiliary_graphs.keys()
+
+    for edge in edges.values():
+        node_ids.update([edge['subject'], edge['object']])
+
+    nodes = {}
+    for nid, node in json_kvitems(trapi_file, 'message.knowledge_graph.nodes'):
+        if nid in node_ids:
+            nodes[nid] = node
+
+    return dict(message=dict(
+        query_graph=query_graph,
+        knowledge_graph=dict(nodes=nodes, edges=edges),
+        auxiliary_graphs=auxiliary_graphs,
+        results=results,
+    ))
+
+
+def json_items(trapi_file, prefix):
+    trapi_file.seek(0)
+    return ijson.items(trapi_file, prefix, use_float=True)
+
+
+def json_kvitems(trapi_file, prefix):
+    trapi_file.seek(0)
+    return ijson.kvitems(trapi_file, prefix, use_float=True)
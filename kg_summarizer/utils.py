@@ -1,59 +1,346 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from hashlib import md5
 from xml.etree import ElementTree as ET
 import logging
+import aiohttp
 import requests
+import kg_summarizer.config as CFG
+import kg_summarizer.transport as transport
 from kg_summarizer.config import CACHE_DIR
+from kg_summarizer.cache import SqliteCache, DirectoryCache
+from kg_summarizer.metrics import track_upstream
 
-def cached_get_pubmed_abstract(pubmed_id, n_retry=5):
-    pubmed_cache_dir = CACHE_DIR / 'pubmed_abstracts'
-    pubmed_cache_dir.mkdir(parents=True, exist_ok=True)
-
-    pubmed_id_num = pubmed_id.split(':')[1]
-    pubmed_cache_file = pubmed_cache_dir / f"{pubmed_id_num}.txt"
-    if pubmed_cache_file.exists():
-        with open(pubmed_cache_file, "r", encoding="utf-8") as file:
-            abstract = file.read()
+EFETCH_URL = CFG.EFETCH_URL
+EFETCH_CHUNK_SIZE = 200
+
+PUBMED_ABSTRACT_DIR = CACHE_DIR / 'pubmed_abstracts'
+
+def get_pubmed_abstract_store(backend=CFG.PUBMED_CACHE_BACKEND):
+    if backend == 'sqlite':
+        return SqliteCache(CACHE_DIR / 'pubmed_abstracts.sqlite', compress=CFG.PUBMED_CACHE_COMPRESS)
+    elif backend == 'files':
+        return DirectoryCache(PUBMED_ABSTRACT_DIR)
     else:
-        abstract = get_pubmed_abstract(pubmed_id, n_retry=n_retry) 
-        if abstract is not None:
-            with open(pubmed_cache_file, "w", encoding="utf-8") as file:
-                file.write(abstract)
+        raise ValueError(f"PubMed cache backend '{backend}' not defined")
+
+PUBMED_ABSTRACT_STORE = get_pubmed_abstract_store()
+pubmed_abstract_dir_migrated = False
+
+def migrate_pubmed_abstract_dir(store=None, src_dir=PUBMED_ABSTRACT_DIR, batch_size=5000):
+    """
+    One-time import of the one-file-per-abstract cache directory into an abstract store.
+    The directory is renamed to '<src_dir>.migrated' afterwards so this only runs once.
+    """
+    store = PUBMED_ABSTRACT_STORE if store is None else store
+    if isinstance(store, DirectoryCache) or (not src_dir.is_dir()):
+        return 0
+
+    n_migrated = 0
+    batch = {}
+    for abstract_file in src_dir.glob('*.txt'):
+        with open(abstract_file, "r", encoding="utf-8") as file:
+            batch[abstract_file.stem] = file.read()
+        if len(batch) >= batch_size:
+            store.set_many(batch)
+            n_migrated += len(batch)
+            batch = {}
+    store.set_many(batch)
+    n_migrated += len(batch)
+
+    try:
+        src_dir.rename(src_dir.with_name(f"{src_dir.name}.migrated"))
+    except OSError:
+        # Another worker finished the migration first
+        pass
+
+    logging.info(f"Migrated {n_migrated} abstracts from {src_dir}")
+    return n_migrated
+
+def cached_get_pubmed_abstract(pubmed_id, n_retry=5):
+    return cached_get_pubmed_abstracts([pubmed_id], n_retry=n_retry).get(pubmed_id)
+
+def cached_get_pubmed_abstracts(pubmed_ids, n_retry=5, chunk_size=EFETCH_CHUNK_SIZE):
+    """
+    Returns a {pubmed_id: abstract} dict for the given 'PMID:<num>' ids. Cached abstracts
+    are read from the abstract store in one lookup and every cache miss is fetched in
+    batched efetch calls.
+    """
+    global pubmed_abstract_dir_migrated
+    if not pubmed_abstract_dir_migrated:
+        migrate_pubmed_abstract_dir()
+        pubmed_abstract_dir_migrated = True
+
+    # The store is keyed on the bare PMID number
+    id_lookup = {pubmed_id.split(':')[1]: pubmed_id for pubmed_id in pubmed_ids}
+    cached = PUBMED_ABSTRACT_STORE.get_many(id_lookup)
+    abstracts = {id_lookup[id_num]: abstract for id_num, abstract in cached.items()}
 
-    return abstract
+    missing_ids = [pubmed_id for id_num, pubmed_id in id_lookup.items() if id_num not in cached]
+    if missing_ids:
+        fetched = get_pubmed_abstracts(missing_ids, n_retry=n_retry, chunk_size=chunk_size)
+        PUBMED_ABSTRACT_STORE.set_many({pubmed_id.split(':')[1]: abstract for pubmed_id, abstract in fetched.items()})
+        abstracts.update(fetched)
+
+    return abstracts
 
 def get_pubmed_abstract(pubmed_id, n_retry=5):
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+    return get_pubmed_abstracts([pubmed_id], n_retry=n_retry).get(pubmed_id)
+
+def get_pubmed_abstracts(pubmed_ids, n_retry=5, chunk_size=EFETCH_CHUNK_SIZE):
+    """
+    Fetches abstracts for many PMIDs with one efetch call per chunk of ids. Returns a
+    {pubmed_id: abstract} dict that only contains the PMIDs with a non-empty abstract.
+    """
+    # efetch wants bare numeric ids, map them back to the ids we were given
+    id_lookup = {str(pubmed_id).split(':')[-1]: pubmed_id for pubmed_id in pubmed_ids}
+    id_nums = list(id_lookup)
+
+    abstracts = {}
+    for chunk_start in range(0, len(id_nums), chunk_size):
+        chunk = id_nums[chunk_start:chunk_start + chunk_size]
+        params = efetch_params(chunk)
+
+        retry_after = None
+        for itry in range(n_retry):
+            if itry > 0:
+                time.sleep(retry_delay(itry - 1, retry_after))
+                retry_after = None
+            PUBMED_RATE_LIMITER.wait_sync()
+            try:
+                # POST is recommended by NCBI for long id lists
+                with track_upstream('eutils'), \
+                        transport.stream('POST', EFETCH_URL, data=params) as (status_code, body_chunks, headers):
+                    if status_code != 200:
+                        logging.warning(f"efetch returned {status_code} for {len(chunk)} PMIDs")
+                        retry_after = headers.get('Retry-After')
+                        continue
+                    chunk_abstracts = parse_pubmed_chunks(body_chunks)
+            except (requests.exceptions.RequestException, ET.ParseError) as e:
+                logging.warning(f"efetch failed for {len(chunk)} PMIDs: {e}")
+                continue
+
+            for id_num, abstract in chunk_abstracts.items():
+                if id_num in id_lookup:
+                    abstracts[id_lookup[id_num]] = abstract
+            break
+
+    return abstracts
+
+def retry_delay(itry, retry_after=None, backoff=None, max_delay=60):
+    """
+    Seconds to wait after failed try `itry` (0 based): the Retry-After header (seconds or an
+    HTTP date) when the server sent one, else exponential backoff with jitter.
+    """
+    if retry_after is not None:
+        try:
+            return min(max(0.0, float(retry_after)), max_delay)
+        except ValueError:
+            try:
+                seconds = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                return min(max(0.0, seconds), max_delay)
+            except (TypeError, ValueError):
+                pass
+    backoff = CFG.PUBMED_RETRY_BACKOFF if backoff is None else backoff
+    return min(backoff * 2 ** itry, max_delay) * random.uniform(0.5, 1)
+
+def efetch_params(id_nums):
     params = {
         "db": "pubmed",
-        "id": str(pubmed_id),
+        "id": ",".join(id_nums),
         "retmode": "xml",
         "rettype": "abstract"
     }
+    if CFG.NCBI_API_KEY:
+        params["api_key"] = CFG.NCBI_API_KEY
+    return params
+
+def parse_pubmed_chunks(body_chunks):
+    """
+    Stream parses a (multi-article) efetch XML document from an iterator of response body
+    chunks and returns {pmid_num: abstract}.
+    """
+    abstracts = {}
+    parser = ET.XMLPullParser(events=("end",))
+    for data in body_chunks:
+        parser.feed(data)
+        for event, element in parser.read_events():
+            parse_pubmed_article(element, abstracts)
+    parser.close()
+    return abstracts
+
+def parse_pubmed_article(element, abstracts):
+    if element.tag not in ("PubmedArticle", "PubmedBookArticle"):
+        return
+
+    pmid_element = element.find("MedlineCitation/PMID")
+    if pmid_element is None:
+        pmid_element = element.find("BookDocument/PMID")
+    abstract_text = format_abstract_text(element.findall(".//AbstractText"))
+    if (pmid_element is not None) and abstract_text:
+        abstracts[pmid_element.text.strip()] = abstract_text
 
-    for itry in range(n_retry):
-        response = requests.get(base_url, params=params)
-        if response.status_code == 200:
-            #print(response.content)
-            xml_root = ET.fromstring(response.content)
-            abstract_elements = xml_root.findall(".//AbstractText")
-            abstract_parts = []
-            for element in abstract_elements:
-                label = element.get("Label")
-                text = element.text
-                if text:
-                    if label:
-                        abstract_parts.append(f"{label}: {text}")
-                    else:
-                        abstract_parts.append(text)
-            abstract_text = " ".join(abstract_parts)
-            if abstract_text:
-                return abstract_text.strip()
-    
-    return None
+    # Drop the parsed article so memory stays flat for large chunks
+    element.clear()
+
+def format_abstract_text(abstract_elements):
+    abstract_parts = []
+    for element in abstract_elements:
+        label = element.get("Label")
+        text = element.text
+        if text:
+            if label:
+                abstract_parts.append(f"{label}: {text}")
+            else:
+                abstract_parts.append(text)
+    return " ".join(abstract_parts).strip()
+
+class RateLimiter:
+    """
+    Spaces out requests so at most `rate` of them pass per second, from threads (`wait_sync()`)
+    and coroutines of any event loop (`wait()`) alike.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # Only held to book the next slot, never while sleeping
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        return delay
+
+    def wait_sync(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+# NCBI's limit is per client, shared by the sync and async efetch calls of the process
+PUBMED_RATE_LIMITER = RateLimiter(CFG.PUBMED_REQUESTS_PER_SECOND)
+
+async def async_cached_get_pubmed_abstracts(pubmed_ids, **kwargs):
+    """
+    Async twin of cached_get_pubmed_abstracts, misses are fetched with async_get_pubmed_abstracts.
+    """
+    global pubmed_abstract_dir_migrated
+    if not pubmed_abstract_dir_migrated:
+        await asyncio.to_thread(migrate_pubmed_abstract_dir)
+        pubmed_abstract_dir_migrated = True
+
+    id_lookup = {pubmed_id.split(':')[1]: pubmed_id for pubmed_id in pubmed_ids}
+    cached = await asyncio.to_thread(PUBMED_ABSTRACT_STORE.get_many, id_lookup)
+    abstracts = {id_lookup[id_num]: abstract for id_num, abstract in cached.items()}
+
+    missing_ids = [pubmed_id for id_num, pubmed_id in id_lookup.items() if id_num not in cached]
+    if missing_ids:
+        fetched = await async_get_pubmed_abstracts(missing_ids, **kwargs)
+        await asyncio.to_thread(
+            PUBMED_ABSTRACT_STORE.set_many,
+            {pubmed_id.split(':')[1]: abstract for pubmed_id, abstract in fetched.items()},
+        )
+        abstracts.update(fetched)
+
+    return abstracts
+
+async def async_get_pubmed_abstracts(
+    pubmed_ids,
+    n_retry=5,
+    chunk_size=EFETCH_CHUNK_SIZE,
+    max_in_flight=CFG.PUBMED_MAX_IN_FLIGHT,
+    requests_per_second=None,
+    session=None,
+):
+    """
+    Fetches efetch chunks concurrently with at most `max_in_flight` open requests and no
+    more than `requests_per_second` new requests per second (default: the process wide
+    PUBMED_RATE_LIMITER). Connections are kept alive and reused through one aiohttp session
+    (pass `session` to share it between calls).
+    """
+    id_lookup = {str(pubmed_id).split(':')[-1]: pubmed_id for pubmed_id in pubmed_ids}
+    id_nums = list(id_lookup)
+    chunks = [id_nums[i:i + chunk_size] for i in range(0, len(id_nums), chunk_size)]
+    if not chunks:
+        return {}
+
+    semaphore = asyncio.Semaphore(max_in_flight)
+    rate_limiter = PUBMED_RATE_LIMITER if requests_per_second is None else RateLimiter(requests_per_second)
+
+    async def fetch_chunk(session, chunk):
+        retry_after = None
+        for itry in range(n_retry):
+            if itry > 0:
+                await asyncio.sleep(retry_delay(itry - 1, retry_after))
+                retry_after = None
+            async with semaphore:
+                await rate_limiter.wait()
+                try:
+                    with track_upstream('eutils'):
+                        async with session.post(EFETCH_URL, data=efetch_params(chunk)) as response:
+                            if response.status != 200:
+                                logging.warning(f"efetch returned {response.status} for {len(chunk)} PMIDs")
+                                retry_after = response.headers.get('Retry-After')
+                                continue
+                            parser = ET.XMLPullParser(events=("end",))
+                            chunk_abstracts = {}
+                            async for data in response.content.iter_chunked(1 << 16):
+                                parser.feed(data)
+                                for event, element in parser.read_events():
+                                    parse_pubmed_article(element, chunk_abstracts)
+                            parser.close()
+                            return chunk_abstracts
+                except (aiohttp.ClientError, asyncio.TimeoutError, ET.ParseError) as e:
+                    logging.warning(f"efetch failed for {len(chunk)} PMIDs: {e}")
+        return {}
+
+    async def fetch_all(session):
+        return await asyncio.gather(*[fetch_chunk(session, chunk) for chunk in chunks])
+
+    if session is None:
+        connector = aiohttp.TCPConnector(limit=max_in_flight)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            results = await fetch_all(session)
+    else:
+        results = await fetch_all(session)
+
+    abstracts = {}
+    for chunk_abstracts in results:
+        for id_num, abstract in chunk_abstracts.items():
+            if id_num in id_lookup:
+                abstracts[id_lookup[id_num]] = abstract
+    return abstracts
+
+def run_coroutine(coro):
+    """
+    Runs a coroutine to completion from sync code, also when called inside a running
+    event loop (e.g. from an async FastAPI handler or a notebook).
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    # Copy the context so the profile of the caller (see profiling.py) is still active
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(contextvars.copy_context().run, asyncio.run, coro).result()
 
 def post_query(url, query_dict):
     try:
-        resp = requests.post(url,json=query_dict,timeout=600)
+        resp = transport.post(url,json=query_dict,timeout=(CFG.HTTP_CONNECT_TIMEOUT, 600))
     except requests.exceptions.ReadTimeout:
         print("Request timed out!")
         logging.warning("Request timed out!")
@@ -68,18 +355,43 @@ def post_query(url, query_dict):
     return resp
 
 
-def normalize_list(l):
-    d = {"curies": l}
-    URL="https://nodenormalization-sri.renci.org/1.3/get_normalized_nodes"
-    x = post_query(URL,d)
-    j = x.json()
-    result_d = {}
-    for k in j.keys():
-        if(j[k]==None):
-            continue
-        idx = j[k]['id']['identifier']
-        label = j[k]['id'].get('label',"")
-        result_d[k] = (idx,label)
+NODE_NORM_URL = CFG.NODE_NORM_URL
+NODE_NORM_CHUNK_SIZE = 1000
+NODE_NORM_CACHE = SqliteCache(
+    CACHE_DIR / 'node_norm.sqlite',
+    ttl=CFG.NODE_NORM_CACHE_TTL,
+    max_entries=CFG.NODE_NORM_CACHE_MAX_ENTRIES,
+    memory_size=CFG.NODE_NORM_CACHE_MEMORY_SIZE,
+)
+
+def normalize_list(l, chunk_size=NODE_NORM_CHUNK_SIZE, use_cache=True):
+    l = list(dict.fromkeys(l))
+
+    # Cached entries are [identifier, label] or None for curies the normalizer doesn't know
+    cached = NODE_NORM_CACHE.get_many(l) if use_cache else {}
+    result_d = {k: tuple(v) for k, v in cached.items() if v is not None}
+
+    missing = [k for k in l if k not in cached]
+    for chunk_start in range(0, len(missing), chunk_size):
+        d = {"curies": missing[chunk_start:chunk_start + chunk_size]}
+        with track_upstream('node_normalizer'):
+            x = post_query(NODE_NORM_URL,d)
+        j = x.json()
+        normalized = {}
+        for k in j.keys():
+            if(j[k]==None):
+                continue
+            idx = j[k]['id']['identifier']
+            label = j[k]['id'].get('label',"")
+            result_d[k] = (idx,label)
+            normalized[k] = [idx,label]
+
+        if use_cache:
+            NODE_NORM_CACHE.set_many(normalized)
+            NODE_NORM_CACHE.set_many(
+                {k: None for k in d["curies"] if k not in normalized},
+                ttl=CFG.NODE_NORM_CACHE_NEGATIVE_TTL,
+            )
     return result_d
 
 def unique_name_from_str(string: str, last_idx: int = 12) -> str:
@@ -0,0 +1,30 @@
+import tempfile
+from pathlib import Path
+
+import pytest
+
+import kg_summarizer.config as CFG
+
+# Module level caches are created on import, keep them out of the project cache directory
+CFG.CACHE_DIR = Path(tempfile.mkdtemp(prefix='kg_summarizer_tests_'))
+CFG.ENV.setdefault('OPENAI_ORGANIZATION_ID', 'test')
+CFG.ENV.setdefault('OPENAI_API_KEY', 'test')
+
+
+def fake_normalize_list(curies, *args, **kwargs):
+    return {curie: (curie, f'Label {curie}') for curie in curies}
+
+@pytest.fixture
+def offline(monkeypatch):
+    """
+    GraphContainer without node normalizer or PubMed requests, every curie maps to
+    'Label <curie>' and no abstracts are found.
+    """
+    import kg_summarizer.trapi as trapi
+
+    async def no_abstracts(pmids):
+        return {}
+
+    monkeypatch.setattr(trapi, 'normalize_list', fake_normalize_list)
+    monkeypatch.setattr(trapi, 'cached_get_pubmed_abstracts', lambda pmids: {})
+    monkeypatch.setattr(trapi, 'async_cached_get_pubmed_abstracts', no_abstracts)
@@ -0,0 +1,74 @@
+import asyncio
+
+from kg_summarizer import ai
+
+
+def test_abstract_batch_isolates_errors(monkeypatch):
+    def pack_abstracts(abstracts, model):
+        raise KeyError(model)
+
+    async def agenerate_response(system_prompt, user_prompt, **kwargs):
+        if 'bad' in user_prompt:
+            raise RuntimeError('broken abstract')
+        return f'Summary of {user_prompt}'
+
+    monkeypatch.setattr(ai, 'pack_abstracts', pack_abstracts)
+    monkeypatch.setattr(ai, 'agenerate_response', agenerate_response)
+
+    results = asyncio.run(ai.asummarize_abstract_batch(
+        {'PMID:1': 'first', 'PMID:2': 'bad', 'PMID:3': ' ', 'PMID:4': 'fourth'}, model='my-finetuned-model'
+    ))
+    assert list(results) == ['PMID:1', 'PMID:2', 'PMID:3', 'PMID:4']
+    assert results['PMID:1'] == {'summary': 'Summary of first'}
+    assert results['PMID:2'] == {'error': 'RuntimeError: broken abstract'}
+    assert results['PMID:3'] == {'error': 'Empty abstract'}
+    assert results['PMID:4'] == {'summary': 'Summary of fourth'}
+
+def test_abstract_batch_retries_failed_pack(monkeypatch):
+    monkeypatch.setattr(ai, 'pack_abstracts', lambda abstracts, model: [abstracts])
+
+    async def agenerate_response(system_prompt, user_prompt, **kwargs):
+        if system_prompt == ai.abstract_pack_prompt():
+            return 'not json'
+        return f'Summary of {user_prompt}'
+
+    monkeypatch.setattr(ai, 'agenerate_response', agenerate_response)
+    results = asyncio.run(ai.asummarize_abstract_batch({'PMID:1': 'first', 'PMID:2': 'second'}))
+    assert results == {'PMID:1': {'summary': 'Summary of first'}, 'PMID:2': {'summary': 'Summary of second'}}
+
+def test_concurrent_publication_summaries_share_requests(monkeypatch, tmp_path):
+    summarized = []
+
+    async def agenerate_response(system_prompt, user_prompt, **kwargs):
+        summarized.append(user_prompt)
+        await asyncio.sleep(0.01)
+        if user_prompt == 'abstract 3':
+            raise asyncio.TimeoutError()
+        return f'Summary of {user_prompt}'
+
+    monkeypatch.setattr(ai, 'agenerate_response', agenerate_response)
+    monkeypatch.setattr(ai, 'ABSTRACT_SUMMARY_STORE', ai.SqliteCache(tmp_path / 'summaries.sqlite'))
+    ai.ABSTRACT_SUMMARY_STORE.set(ai.abstract_summary_key('PMID:4'), 'Stored summary')
+
+    # Edges citing overlapping PMIDs, summarized concurrently like in /summarize/edges
+    edges = [
+        [{f'PMID:{idx}': f'abstract {idx}'} for idx in pmids]
+        for pmids in ([1, 2], [2, 3, 4], [1, 2, 3, 1], [4])
+    ]
+
+    async def summarize_edges():
+        return await asyncio.gather(*[ai.asummarize_publications(publications) for publications in edges])
+
+    summaries = asyncio.run(summarize_edges())
+    assert sorted(summarized) == ['abstract 1', 'abstract 2', 'abstract 3']
+    assert summaries[2] == [
+        {'PMID:1': 'Summary of abstract 1'},
+        {'PMID:2': 'Summary of abstract 2'},
+        {'PMID:3': 'abstract 3'},
+        {'PMID:1': 'Summary of abstract 1'},
+    ]
+    assert summaries[3] == [{'PMID:4': 'Stored summary'}]
+
+    # Later calls read the store, failed summaries are retried
+    asyncio.run(summarize_edges())
+    assert sorted(summarized) == ['abstract 1', 'abstract 2', 'abstract 3', 'abstract 3']
@@ -0,0 +1,109 @@
+import io
+import json
+import os
+import tracemalloc
+
+import pytest
+
+import kg_summarizer.cache as cache_module
+from kg_summarizer.cache import SqliteCache
+
+
+def test_file_entries_stream(tmp_path):
+    cache = SqliteCache(tmp_path / 'files.sqlite', compress=True)
+    document = json.dumps({'values': [os.urandom(512).hex() for _ in range(16_000)]}).encode('utf-8')
+
+    source = tmp_path / 'document.json'
+    source.write_bytes(document)
+    tracemalloc.start()
+    with open(source, 'rb') as json_file:
+        cache.set_file('doc', json_file, chunk_size=1 << 16)
+    json_file = cache.open_file('doc', chunk_size=1 << 16)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Neither the document (16 MB) nor its compressed bytes are held in memory
+    assert peak_bytes < len(document) / 8
+    assert json_file.read() == document
+    assert cache.open_file('missing') is None
+
+def test_file_entries_evict_on_cadence(tmp_path):
+    cache = SqliteCache(tmp_path / 'files.sqlite', max_entries=2, evict_every=3)
+    for idx in range(3):
+        cache.set_file(f'doc{idx}', io.BytesIO(b'{}'))
+    assert len(cache) == 2
+
+    cache.set_file('doc3', io.BytesIO(b'{}'))
+    assert len(cache) == 3
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module, 'time', clock)
+    return clock
+
+@pytest.mark.parametrize('memory_size', [0, 10])
+def test_get_set(tmp_path, memory_size):
+    cache = SqliteCache(tmp_path / 'kv.sqlite', compress=True, memory_size=memory_size)
+    cache.set_many({'a': {'value': [1, 2]}, 'b': 'text'})
+    assert cache.get('a') == {'value': [1, 2]}
+    assert cache.get_many(['a', 'b', 'c']) == {'a': {'value': [1, 2]}, 'b': 'text'}
+    assert cache.get('c', 'default') == 'default'
+
+    # Other instances (e.g. other workers) read the same file
+    assert SqliteCache(tmp_path / 'kv.sqlite').get_many(['a', 'b']) == {'a': {'value': [1, 2]}, 'b': 'text'}
+
+@pytest.mark.parametrize('memory_size', [0, 10])
+def test_ttl(tmp_path, clock, memory_size):
+    cache = SqliteCache(tmp_path / 'kv.sqlite', ttl=100, memory_size=memory_size)
+    cache.set('default_ttl', 1)
+    cache.set('short_ttl', 2, ttl=10)
+
+    clock.now += 50
+    assert cache.get_many(['default_ttl', 'short_ttl']) == {'default_ttl': 1}
+    clock.now += 51
+    assert cache.get_many(['default_ttl', 'short_ttl']) == {}
+
+def test_negative_entries(tmp_path):
+    cache = SqliteCache(tmp_path / 'kv.sqlite')
+    cache.set('unknown', None)
+    # A cached None is a hit, not a miss
+    assert cache.get_many(['unknown', 'missing']) == {'unknown': None}
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+def test_evicts_least_recently_used(tmp_path, clock):
+    cache = SqliteCache(tmp_path / 'kv.sqlite', max_entries=2, evict_every=1)
+    cache.set('a', 1)
+    clock.now += 1
+    cache.set('b', 2)
+    clock.now += 1
+    cache.get('a')
+    clock.now += 1
+    cache.set('c', 3)
+    assert SqliteCache(tmp_path / 'kv.sqlite').get_many(['a', 'b', 'c']) == {'a': 1, 'c': 3}
+
+def test_evicts_to_max_bytes(tmp_path, clock):
+    cache = SqliteCache(tmp_path / 'kv.sqlite', max_bytes=250, evict_every=1)
+    for idx in range(5):
+        cache.set(f'key{idx}', 'x' * 100)
+        clock.now += 1
+    assert len(cache) == 2
+    assert cache.stats()['bytes'] <= 250
+    assert list(SqliteCache(tmp_path / 'kv.sqlite').get_many([f'key{idx}' for idx in range(5)])) == ['key3', 'key4']
+
+def test_evicts_expired_entries(tmp_path, clock):
+    cache = SqliteCache(tmp_path / 'kv.sqlite', evict_every=2)
+    cache.set('expires', 1, ttl=10)
+    clock.now += 11
+    cache.set('stays', 2)
+    assert len(cache) == 1
@@ -0,0 +1,33 @@
+import random
+
+from kg_summarizer.ranking import RankedResults, result_score
+
+
+def make_results(n_results, seed=0):
+    rnd = random.Random(seed)
+    # Few distinct scores so there are ties
+    return [dict(idx=idx, analyses=[dict(score=rnd.randint(0, 20))]) for idx in range(n_results)]
+
+def test_result_score():
+    assert result_score(dict(analyses=[dict(score=0.2), dict(score=0.7), dict()])) == 0.7
+    assert result_score(dict(analyses=[dict(score=0.2), dict(score=0.7)]), reduce=min) == 0.2
+    assert result_score(dict(analyses=[dict()])) == float('-inf')
+    assert result_score(dict(analyses=[dict(ranking=3)]), rank_by='ranking') == 3
+
+def test_ranked_results_match_a_stable_sort():
+    results = make_results(500)
+    expected = sorted(results, key=result_score, reverse=True)
+
+    ranked = RankedResults(results, k=5)
+    assert len(ranked.ranked) == 5
+    assert ranked[0] is expected[0]
+    # Indexes past the selection extend it
+    assert ranked[37] is expected[37]
+    assert ranked[10:20] == expected[10:20]
+    assert ranked[-1] is expected[-1]
+    assert list(ranked) == expected
+    assert len(ranked) == 500
+
+def test_unscored_results_rank_last():
+    results = [dict(idx=0, analyses=[dict()]), dict(idx=1, analyses=[dict(score=0.1)])]
+    assert [result['idx'] for result in RankedResults(results)] == [1, 0]
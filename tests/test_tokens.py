@@ -0,0 +1,59 @@
+import pytest
+import tiktoken
+
+from kg_summarizer import tokens
+from kg_summarizer.tokens import DEFAULT_MODEL_LIMITS, OPENAI_MODEL_LIMITS, model_limits, pack_token_budget
+
+
+class WhitespaceEncoding:
+    def encode_ordinary_batch(self, strings, num_threads=8):
+        return [string.split() for string in strings]
+
+
+@pytest.fixture
+def encoding(monkeypatch):
+    # tiktoken downloads its BPE ranks on first use
+    monkeypatch.setattr(tokens, 'get_encoding', lambda model_name: WhitespaceEncoding())
+
+def test_count_tokens(encoding):
+    assert tokens.count_tokens(['one two', '', 'three'], 'gpt-4') == [2, 0, 1]
+    assert tokens.count_tokens(iter(['one two']), 'gpt-4') == [2]
+
+def test_estimate_tokens(encoding):
+    estimate = tokens.estimate_tokens(['word ' * 1000, 'word ' * 500], 'gpt-4', completion_tokens=100)
+    assert estimate.counts == [1000, 500]
+    assert estimate.total == 1500
+    assert estimate.input_cost == pytest.approx(1.5 * 0.03)
+    assert estimate.output_cost == pytest.approx(0.2 * 0.06)
+    assert estimate.cost == pytest.approx(0.045 + 0.012)
+    assert not estimate.exceeds_limit
+    assert tokens.estimate_tokens(['word ' * 9000], 'gpt-4').exceeds_limit
+
+def test_pack_token_budget():
+    assert pack_token_budget([], 100) == []
+    assert pack_token_budget([40, 40, 40, 10], 100) == [[0, 1], [2, 3]]
+    # Items over the budget get a batch of their own
+    assert pack_token_budget([10, 500, 10], 100) == [[0], [1], [2]]
+    assert pack_token_budget([30, 30, 30], 100, item_overhead=10) == [[0, 1], [2]]
+    assert pack_token_budget([1, 1, 1, 1, 1], 100, max_items=2) == [[0, 1], [2, 3], [4]]
+    assert pack_token_budget([1000, 1000], None) == [[0, 1]]
+
+def test_model_limits():
+    assert model_limits('gpt-4') is OPENAI_MODEL_LIMITS['gpt-4']
+    assert model_limits('gpt-4-0613') is OPENAI_MODEL_LIMITS['gpt-4']
+    assert model_limits('gpt-4-32k-0613') is OPENAI_MODEL_LIMITS['gpt-4-32k']
+    assert model_limits('ft:gpt-3.5-turbo-16k-0613:org::abc123') is OPENAI_MODEL_LIMITS['gpt-3.5-turbo-16k']
+    assert model_limits('gpt-4o') is DEFAULT_MODEL_LIMITS
+    assert model_limits('my-finetuned-model') is DEFAULT_MODEL_LIMITS
+
+def test_get_encoding_falls_back_for_unmapped_models(monkeypatch):
+    def encoding_for_model(model_name):
+        raise KeyError(model_name)
+
+    monkeypatch.setattr(tiktoken, 'encoding_for_model', encoding_for_model)
+    monkeypatch.setattr(tiktoken, 'get_encoding', lambda name: f'encoding {name}')
+    tokens.get_encoding.cache_clear()
+    try:
+        assert tokens.get_encoding('my-finetuned-model') == 'encoding cl100k_base'
+    finally:
+        tokens.get_encoding.cache_clear()
@@ -0,0 +1,137 @@
+import pickle
+
+from benchmarks.synthetic import make_trapi_response
+from kg_summarizer import trapi
+from kg_summarizer.trapi import GraphContainer, merge_trapi_responses, result_support_graphs
+
+
+def test_graph_container_pickles(offline):
+    # st.cache_data in app.py pickles the container
+    g = GraphContainer(make_trapi_response(creative=True, n_results=5, n_nodes=20), verbose=False)
+    g.print_results(1)
+
+    loaded = pickle.loads(pickle.dumps(g))
+    assert loaded.edges == g.edges
+    assert loaded.profile.as_dict() == g.profile.as_dict()
+    loaded.profile.add('after_load', 0.1)
+    assert loaded.profile.stages['after_load'].calls == 1
+
+
+def make_response(edges, score, support_graphs=None):
+    return dict(message=dict(
+        query_graph=dict(nodes=dict(n0={}, n1={}), edges=dict(e0=dict(subject='n0', object='n1'))),
+        knowledge_graph=dict(
+            nodes={
+                'CHEBI:1': dict(name='drug', attributes=[]),
+                'MONDO:1': dict(name='disease', attributes=[]),
+            },
+            edges={
+                eid: dict(subject='CHEBI:1', object='MONDO:1', predicate=predicate, attributes=[
+                    dict(attribute_type_id='biolink:publications', value=pmids),
+                ])
+                for eid, (predicate, pmids) in edges.items()
+            },
+        ),
+        auxiliary_graphs={sgid: dict(edges=list(edges)) for sgid in support_graphs or []},
+        results=[dict(
+            node_bindings=dict(n0=[dict(id='CHEBI:1')], n1=[dict(id='MONDO:1')]),
+            analyses=[dict(
+                resource_id='infores:ara', score=score, support_graphs=support_graphs or [],
+                edge_bindings=dict(e0=[dict(id=eid) for eid in edges]),
+            )],
+        )],
+    ))
+
+def test_container_reads_every_analysis_of_merged_results(offline):
+    merged = merge_trapi_responses({
+        'aragorn': make_response({'e1': ('biolink:treats', ['PMID:1'])}, score=0.2, support_graphs=['sg1']),
+        'robokop': make_response({'e1': ('biolink:affects', ['PMID:2', 'PMID:3'])}, score=0.9),
+    })
+    assert len(merged['message']['results']) == 1
+    assert len(merged['message']['results'][0]['analyses']) == 2
+
+    g = GraphContainer(merged, verbose=False)
+    g.get_edge_info(fetch_pubs=False)
+    assert sorted(edge['predicate'] for edge in g.edges) == ['affects', 'treats']
+
+    rows = g.result_rows()
+    assert [(row['edge_id'], row['predicate'], row['n_publications']) for row in rows] == [
+        ('e1', 'biolink:treats', 1), ('robokop:e1', 'biolink:affects', 2),
+    ]
+    assert {row['score'] for row in rows} == {0.9}
+    assert result_support_graphs(g.result) == ['aragorn:sg1']
+
+def test_merge_trapi_responses():
+    merged = merge_trapi_responses({
+        'aragorn': make_response({'e1': ('biolink:treats', ['PMID:1'])}, 0.9, support_graphs=['sg']),
+        'arax': make_response({
+            'x1': ('biolink:treats', ['PMID:2']),
+            'e1': ('biolink:affects', ['PMID:3']),
+        }, 0.5, support_graphs=['sg']),
+    })['message']
+
+    # Same (subject, predicate, object) edges merge their attributes; clashing ids get prefixed
+    edges = merged['knowledge_graph']['edges']
+    assert sorted(edges) == ['arax:e1', 'e1']
+    assert edges['e1']['attributes'] == [
+        dict(attribute_type_id='biolink:publications', value=['PMID:1']),
+        dict(attribute_type_id='biolink:publications', value=['PMID:2']),
+    ]
+    assert edges['arax:e1']['predicate'] == 'biolink:affects'
+    assert sorted(merged['knowledge_graph']['nodes']) == ['CHEBI:1', 'MONDO:1']
+
+    assert merged['auxiliary_graphs'] == {
+        'aragorn:sg': dict(edges=['e1']),
+        'arax:sg': dict(edges=['e1', 'arax:e1']),
+    }
+
+    # Results with the same node bindings merge their analyses
+    [result] = merged['results']
+    assert [analysis['score'] for analysis in result['analyses']] == [0.9, 0.5]
+    assert result['analyses'][1]['edge_bindings'] == dict(e0=[dict(id='e1'), dict(id='arax:e1')])
+    assert result['analyses'][1]['support_graphs'] == ['arax:sg']
+
+def test_merge_trapi_responses_unions_sources():
+    responses = {}
+    for target, sources in [
+        ('aragorn', [
+            dict(resource_id='infores:aragorn', resource_role='aggregator_knowledge_source', upstream_resource_ids=['infores:a']),
+            dict(resource_id='infores:semmeddb', resource_role='primary_knowledge_source'),
+        ]),
+        ('robokop', [
+            dict(resource_id='infores:aragorn', resource_role='aggregator_knowledge_source', upstream_resource_ids=['infores:b']),
+            dict(resource_id='infores:semmeddb', resource_role='primary_knowledge_source'),
+            dict(resource_id='infores:robokop', resource_role='aggregator_knowledge_source'),
+        ]),
+    ]:
+        responses[target] = make_response({'e1': ('biolink:treats', ['PMID:1'])}, 0.5)
+        responses[target]['message']['knowledge_graph']['edges']['e1']['sources'] = sources
+
+    edges = merge_trapi_responses(responses)['message']['knowledge_graph']['edges']
+    assert list(edges) == ['e1']
+    assert edges['e1']['sources'] == [
+        dict(resource_id='infores:aragorn', resource_role='aggregator_knowledge_source', upstream_resource_ids=['infores:a', 'infores:b']),
+        dict(resource_id='infores:semmeddb', resource_role='primary_knowledge_source'),
+        dict(resource_id='infores:robokop', resource_role='aggregator_knowledge_source'),
+    ]
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+def test_query_knowledge_graphs_leaves_out_failing_targets(monkeypatch):
+    upstream = {
+        'aragorn': FakeResponse(200, make_response({'e1': ('biolink:treats', ['PMID:1'])}, 0.5)),
+        'robokop': FakeResponse(500, {'detail': 'Internal Server Error'}),
+        'strider': FakeResponse(200, {'detail': 'Query graph not supported'}),
+    }
+    monkeypatch.setattr(trapi, 'get_trapi_request', lambda query_graph, target, **kwargs: (target, {}, {}))
+    monkeypatch.setattr(trapi.transport, 'post', lambda url, **kwargs: upstream[url])
+
+    merged = trapi.query_knowledge_graphs({}, targets=list(upstream))
+    assert list(merged['message']['knowledge_graph']['edges']) == ['e1']
+    assert len(merged['message']['results']) == 1
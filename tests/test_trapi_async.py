@@ -0,0 +1,87 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiohttp
+import pytest
+
+from kg_summarizer.trapi_async import ASYNC_QUERIES, AsyncQuery, AsyncQueryError, poll_async_query, submit_async_query
+
+QUERY_GRAPH = dict(nodes=dict(n0={}, n1={}), edges=dict(e0=dict(subject='n0', object='n1')))
+
+
+class FakeResponse:
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    async def json(self, content_type=None):
+        if isinstance(self.body, Exception):
+            raise self.body
+        return self.body
+
+
+class FakeSession:
+    def __init__(self, response=None, error=None, get_responses=None):
+        self.response = response
+        self.error = error
+        # {url: [responses]}, the last one repeats
+        self.get_responses = get_responses or {}
+
+    @asynccontextmanager
+    async def post(self, url, **kwargs):
+        if self.error is not None:
+            raise self.error
+        yield self.response
+
+    @asynccontextmanager
+    async def get(self, url, **kwargs):
+        responses = self.get_responses[url]
+        yield responses.pop(0) if len(responses) > 1 else responses[0]
+
+
+@pytest.mark.parametrize('session, error', [
+    (FakeSession(error=aiohttp.ClientConnectionError('connection refused')), aiohttp.ClientError),
+    (FakeSession(FakeResponse(500, {})), AsyncQueryError),
+    (FakeSession(FakeResponse(200, {})), AsyncQueryError), # nothing to poll
+])
+def test_failed_submit_is_not_registered(session, error):
+    with pytest.raises(error):
+        asyncio.run(submit_async_query(QUERY_GRAPH, target='aragorn', session=session, poll=True))
+    assert ASYNC_QUERIES == {}
+
+
+STATUS_URL = 'https://ara/asyncquery_status/remote1'
+
+def poll(get_responses, timeout=1):
+    async def run():
+        query = AsyncQuery('job1', 'aragorn', 'https://ara/asyncquery', asyncio.get_running_loop().create_future(), 'remote1')
+        ASYNC_QUERIES[query.job_id] = query
+        try:
+            await poll_async_query(query, interval=0, session=FakeSession(get_responses=get_responses), timeout=timeout)
+        finally:
+            del ASYNC_QUERIES[query.job_id]
+        return query
+
+    return asyncio.run(run())
+
+def test_poll_resolves_completed_query():
+    query = poll({
+        STATUS_URL: [FakeResponse(503, {}), FakeResponse(200, {'status': 'Running'}),
+                     FakeResponse(200, {'status': 'Completed', 'response_url': 'https://ara/response'})],
+        'https://ara/response': [FakeResponse(200, {'message': {}})],
+    })
+    assert query.status == 'Completed'
+    assert query.future.result() == {'message': {}}
+
+@pytest.mark.parametrize('status_response, error', [
+    (FakeResponse(200, ValueError('Expecting value')), 'ValueError'),
+    (FakeResponse(200, ['Running']), 'AttributeError'),
+    (FakeResponse(200, {'status': 'Completed'}), 'without a response_url'),
+    (FakeResponse(200, {'status': 'Failed', 'description': 'ARA error'}), 'ARA error'),
+    (FakeResponse(200, {'status': 'Running'}), 'did not complete within'),
+])
+def test_poll_always_resolves_the_query(status_response, error):
+    query = poll({STATUS_URL: [status_response]}, timeout=0.05)
+    assert query.status == 'Failed'
+    assert isinstance(query.future.exception(), AsyncQueryError)
+    assert error in str(query.future.exception())
@@ -0,0 +1,70 @@
+import io
+import json
+
+from kg_summarizer.trapi_stream import load_trapi_subgraph
+
+
+def make_edge(subject, object, support_graphs=()):
+    attributes = [dict(attribute_type_id='biolink:publications', value=['PMID:1'])]
+    if support_graphs:
+        attributes.append(dict(attribute_type_id='biolink:support_graphs', value=list(support_graphs)))
+    return dict(subject=subject, object=object, predicate='biolink:related_to', attributes=attributes)
+
+def make_result(subject, object, score, edge_ids, support_graphs=()):
+    return dict(
+        node_bindings=dict(n0=[dict(id=subject)], n1=[dict(id=object)]),
+        analyses=[dict(
+            score=score, support_graphs=list(support_graphs),
+            edge_bindings=dict(t_edge=[dict(id=eid) for eid in edge_ids]),
+        )],
+    )
+
+def make_trapi_file():
+    # e_ab is supported by sg1 -> e_ac, which is supported by sg2 -> e_cd
+    message = dict(
+        query_graph=dict(nodes=dict(n0={}, n1={}), edges=dict(t_edge=dict(subject='n0', object='n1'))),
+        knowledge_graph=dict(
+            nodes={nid: dict(name=f'Node {nid}') for nid in 'ABCDEFG'},
+            edges=dict(
+                e_ab=make_edge('A', 'B', support_graphs=['sg1']),
+                e_ac=make_edge('A', 'C', support_graphs=['sg2']),
+                e_cd=make_edge('C', 'D'),
+                e_ef=make_edge('E', 'F'),
+                e_bg=make_edge('B', 'G'),
+            ),
+        ),
+        auxiliary_graphs=dict(
+            sg1=dict(edges=['e_ac']),
+            sg2=dict(edges=['e_cd']),
+            sg3=dict(edges=['e_ef']),
+        ),
+        results=[
+            make_result('A', 'B', 0.5, ['e_ab']),
+            make_result('G', 'B', 0.1, ['e_bg']),
+            make_result('A', 'D', 0.9, ['e_cd', 'not_in_kg']),
+            make_result('E', 'F', 0.5, ['e_ef'], support_graphs=['sg3']),
+        ],
+    )
+    return message, io.BytesIO(json.dumps(dict(message=message)).encode('utf-8'))
+
+
+def test_load_trapi_subgraph_keeps_top_k_and_their_subgraph():
+    message, trapi_file = make_trapi_file()
+    subgraph = load_trapi_subgraph(trapi_file, top_k=2)['message']
+
+    # Ties keep the order of the response
+    assert subgraph['results'] == [message['results'][2], message['results'][0]]
+    assert subgraph['query_graph'] == message['query_graph']
+    # Support graphs are followed transitively and dangling edge ids are dropped
+    assert sorted(subgraph['knowledge_graph']['edges']) == ['e_ab', 'e_ac', 'e_cd']
+    assert sorted(subgraph['auxiliary_graphs']) == ['sg1', 'sg2']
+    assert sorted(subgraph['knowledge_graph']['nodes']) == ['A', 'B', 'C', 'D']
+    assert subgraph['knowledge_graph']['edges']['e_ab'] == message['knowledge_graph']['edges']['e_ab']
+
+def test_load_trapi_subgraph_keeps_every_result_under_top_k():
+    message, trapi_file = make_trapi_file()
+    subgraph = load_trapi_subgraph(trapi_file, top_k=10)['message']
+
+    assert [result['analyses'][0]['score'] for result in subgraph['results']] == [0.9, 0.5, 0.5, 0.1]
+    assert sorted(subgraph['auxiliary_graphs']) == ['sg1', 'sg2', 'sg3']
+    assert sorted(subgraph['knowledge_graph']['nodes']) == list('ABCDEFG')
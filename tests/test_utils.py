@@ -0,0 +1,112 @@
+from contextlib import contextmanager
+
+import pytest
+
+from kg_summarizer import utils
+from kg_summarizer.cache import DirectoryCache, SqliteCache
+
+EFETCH_XML = (
+    b'<?xml version="1.0"?><PubmedArticleSet>'
+    b'<PubmedArticle><MedlineCitation><PMID>1</PMID><Article><Abstract>'
+    b'<AbstractText Label="BACKGROUND">First part.</AbstractText><AbstractText>Second part.</AbstractText>'
+    b'</Abstract></Article></MedlineCitation></PubmedArticle>'
+    b'<PubmedArticle><MedlineCitation><PMID>2</PMID><Article></Article></MedlineCitation></PubmedArticle>'
+    b'<PubmedBookArticle><BookDocument><PMID>3</PMID><Abstract>'
+    b'<AbstractText>Book &amp; chapter.</AbstractText></Abstract></BookDocument></PubmedBookArticle>'
+    b'</PubmedArticleSet>'
+)
+
+
+def test_parse_pubmed_chunks():
+    # Chunk boundaries fall anywhere, also inside tags
+    chunks = [EFETCH_XML[i:i + 7] for i in range(0, len(EFETCH_XML), 7)]
+    assert utils.parse_pubmed_chunks(chunks) == {
+        '1': 'BACKGROUND: First part. Second part.',
+        '3': 'Book & chapter.',
+    }
+
+def test_get_pubmed_abstracts_batches_ids(monkeypatch):
+    requested_ids = []
+
+    @contextmanager
+    def stream(method, url, data, **kwargs):
+        requested_ids.append(data['id'])
+        yield 200, [EFETCH_XML], {}
+
+    monkeypatch.setattr(utils.transport, 'stream', stream)
+    monkeypatch.setattr(utils.PUBMED_RATE_LIMITER, 'wait_sync', lambda: None)
+    abstracts = utils.get_pubmed_abstracts(['PMID:1', 'PMID:2', 'PMID:3'], chunk_size=2)
+    assert requested_ids == ['1,2', '3']
+    # Only the PMIDs with an abstract, under the ids they were requested with
+    assert abstracts == {'PMID:1': 'BACKGROUND: First part. Second part.', 'PMID:3': 'Book & chapter.'}
+
+def test_retry_delay():
+    assert utils.retry_delay(0, retry_after='3') == 3
+    assert utils.retry_delay(0, retry_after='3600') == 60
+    assert utils.retry_delay(0, retry_after='Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert 2 <= utils.retry_delay(2, backoff=1) <= 4
+
+def test_efetch_backs_off_and_honours_retry_after(monkeypatch):
+    responses = [
+        (429, [b'Too many requests'], {'Retry-After': '2'}),
+        (503, [b'Unavailable'], {}),
+        (200, [EFETCH_XML], {}),
+    ]
+
+    @contextmanager
+    def stream(method, url, **kwargs):
+        yield responses.pop(0)
+
+    sleeps = []
+    monkeypatch.setattr(utils.transport, 'stream', stream)
+    monkeypatch.setattr(utils.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(utils.PUBMED_RATE_LIMITER, 'wait_sync', lambda: None)
+
+    assert utils.get_pubmed_abstracts(['PMID:1'], n_retry=5) == {'PMID:1': 'BACKGROUND: First part. Second part.'}
+    assert responses == []
+    assert sleeps[0] == 2
+    assert 0.5 * utils.CFG.PUBMED_RETRY_BACKOFF * 2 <= sleeps[1] <= utils.CFG.PUBMED_RETRY_BACKOFF * 2
+
+def test_rate_limiter_spaces_out_requests(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(utils.time, 'sleep', sleeps.append)
+    rate_limiter = utils.RateLimiter(4)
+    for _ in range(3):
+        rate_limiter.wait_sync()
+    assert len(sleeps) == 2
+    assert 0.2 < sleeps[0] <= 0.25 and 0.45 < sleeps[1] <= 0.5
+
+def test_migrate_pubmed_abstract_dir(tmp_path):
+    src_dir = tmp_path / 'pubmed_abstracts'
+    src_dir.mkdir()
+    for idx in range(5):
+        (src_dir / f'{idx}.txt').write_text(f'Abstract {idx}', encoding='utf-8')
+
+    store = SqliteCache(tmp_path / 'pubmed_abstracts.sqlite', compress=True)
+    assert utils.migrate_pubmed_abstract_dir(store, src_dir, batch_size=2) == 5
+    assert store.get_many(['0', '4', '5']) == {'0': 'Abstract 0', '4': 'Abstract 4'}
+    assert (tmp_path / 'pubmed_abstracts.migrated').is_dir()
+    # The renamed directory isn't imported again
+    assert utils.migrate_pubmed_abstract_dir(store, src_dir) == 0
+
+@pytest.mark.parametrize('backend', ['sqlite', 'files'])
+def test_cached_get_pubmed_abstracts_fetches_misses(monkeypatch, tmp_path, backend):
+    if backend == 'sqlite':
+        store = SqliteCache(tmp_path / 'pubmed_abstracts.sqlite')
+    else:
+        store = DirectoryCache(tmp_path / 'pubmed_abstracts')
+    store.set_many({'1': 'Cached'})
+
+    fetched_ids = []
+    def get_pubmed_abstracts(pubmed_ids, **kwargs):
+        fetched_ids.extend(pubmed_ids)
+        return {pubmed_id: 'Fetched' for pubmed_id in pubmed_ids if pubmed_id != 'PMID:3'}
+
+    monkeypatch.setattr(utils, 'PUBMED_ABSTRACT_STORE', store)
+    monkeypatch.setattr(utils, 'pubmed_abstract_dir_migrated', True)
+    monkeypatch.setattr(utils, 'get_pubmed_abstracts', get_pubmed_abstracts)
+
+    abstracts = utils.cached_get_pubmed_abstracts(['PMID:1', 'PMID:2', 'PMID:3'])
+    assert abstracts == {'PMID:1': 'Cached', 'PMID:2': 'Fetched'}
+    assert fetched_ids == ['PMID:2', 'PMID:3']
+    assert store.get_many(['1', '2', '3']) == {'1': 'Cached', '2': 'Fetched'}